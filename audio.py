@@ -0,0 +1,246 @@
+'''
+__author       = "Chen Si-En, Sarah"
+__copyright    = "Copyright 2021, Chen Si-En, Sarah"
+
+__description  = "Preloaded sound bank with per-language audio bundles and audio dispatcher"
+__version      = "1.2.0"
+__status       = "Production"
+__dependencies = "numpy, pygame"
+'''
+
+import os
+import glob
+import heapq
+import threading
+import numpy as np
+from collections import deque
+from random import choice
+from time import perf_counter
+
+# file name prefix of each language; 0: English, 1: Chinese
+LANGUAGE_PREFIXES = {0: 'en', 1: 'cn'}
+
+# audio categories in order of priority; a lower value plays first
+CUE = 0
+ENCOURAGEMENT = 1
+BEEP = 2
+CATEGORY_NAMES = {CUE: "cue", ENCOURAGEMENT: "encouragement", BEEP: "beep"}
+
+# minimum seconds between two requests of a category that are played
+RATE_LIMITS = {CUE: 2.5, ENCOURAGEMENT: 2.5, BEEP: 0.1}
+
+# reserved mixer channels; spoken cue and encouragement share one so they never overlap
+METRONOME_CHANNEL = 0
+VOICE_CHANNEL = 1
+BEEP_CHANNEL = 2
+RESERVED_CHANNELS = 3
+CATEGORY_CHANNELS = {CUE: VOICE_CHANNEL, ENCOURAGEMENT: VOICE_CHANNEL, BEEP: BEEP_CHANNEL}
+
+class SoundBank(object):
+    ''' ALL AUDIO FILES DECODED ONCE AT STARTUP
+            Sounds are looked up by file path, so paths can still be passed between
+            threads and processes. Cue and encouragement paths are grouped into one bundle
+            per language; switching language swaps the current bundle.
+    Args:
+            mixer  : (pygame mixer, required) Audio mixer, initialized.
+            path   : (string,       optional) Audio directory. Defaults to 'rsc/audio'.
+    '''
+
+    def __init__(self, mixer, path='rsc/audio'):
+        self.mixer = mixer
+
+        # decoded sounds by path
+        self.sounds = {}
+        for sound_path in sorted(glob.glob(os.path.join(path, '*.wav'))):
+            self.sounds[sound_path] = mixer.Sound(sound_path)
+
+        self.beep = os.path.join(path, 'beep.wav')
+        self.tick = os.path.join(path, 'tick.wav')
+
+        ## per-language bundles
+        self.bundles = {}
+        for lang, prefix in LANGUAGE_PREFIXES.items():
+            self.bundles[lang] = {
+                "cue" : sorted(glob.glob(os.path.join(path, prefix + '_cue-*.wav'))),
+                "encouragement" : sorted(glob.glob(os.path.join(path, prefix + '_encouragement-*.wav'))),
+            }
+        self.bundle = self.bundles[0]
+
+    def setLanguage(self, lang):
+        ''' SWITCH TO BUNDLE OF LANGUAGE
+        Args:
+                lang    : (int, required) 0: English, 1: Chinese.
+
+        Returns:
+                bundle  : (dict) Cue and encouragement paths of language.
+        '''
+
+        self.bundle = self.bundles[lang]
+
+        return self.bundle
+
+    def get(self, sound_path):
+        ''' GET DECODED SOUND; FILES ADDED AFTER STARTUP ARE DECODED ON FIRST USE
+        Args:
+                sound_path  : (string, required) Path to audio file.
+
+        Returns:
+                sound       : (Sound) Decoded sound.
+        '''
+
+        if sound_path not in self.sounds:
+            self.sounds[sound_path] = self.mixer.Sound(sound_path)
+
+        return self.sounds[sound_path]
+
+    def play(self, sound_path):
+        ''' PLAY DECODED SOUND
+        Args:
+                sound_path  : (string, required) Path to audio file.
+        '''
+
+        self.get(sound_path).play()
+
+class AudioDispatcher(object):
+    ''' NON-BLOCKING AUDIO PLAYBACK ON ITS OWN THREAD
+            Callers only add a small request (category and time) to a bounded priority
+            queue; the dispatcher thread picks the sound, applies the rate limit of its
+            category and plays it on the channel reserved for it, so a mixer stall never
+            delays the caller. Cue plays before encouragement before beep. When the queue
+            is full, the lowest priority request is dropped. A sound preempts one of lower
+            priority on its channel and is dropped if one of higher priority is playing.
+            The time from request to playback of every sound is logged.
+    Args:
+            sound_bank  : (SoundBank,    required) Decoded sounds.
+            mixer       : (pygame mixer, required) Audio mixer, initialized, with RESERVED_CHANNELS reserved.
+            capacity    : (int,          optional) Maximum requests waiting. Defaults to 8.
+            log_length  : (int,          optional) Number of sounds kept in the log. Defaults to 1000.
+    '''
+
+    def __init__(self, sound_bank, mixer, capacity=8, log_length=1000):
+        self.sound_bank = sound_bank
+        self.capacity = capacity
+
+        # reserved channel of each category, and category playing on each channel
+        self.channels = {channel: mixer.Channel(channel) for channel in set(CATEGORY_CHANNELS.values())}
+        self.playing = {channel: None for channel in self.channels}
+
+        # priority queue of (category, sequence, request time)
+        self.heap = []
+        self.seq = 0
+        self.cond = threading.Condition()
+
+        # counters and log of (category, request time, playback time)
+        self.last_played = {category: -np.inf for category in CATEGORY_NAMES}
+        self.dropped = {category: 0 for category in CATEGORY_NAMES}
+        self.limited = {category: 0 for category in CATEGORY_NAMES}
+        self.busy = {category: 0 for category in CATEGORY_NAMES}
+        self.log = deque(maxlen=log_length)
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def request(self, category, timestamp=None):
+        ''' ADD PLAYBACK REQUEST TO QUEUE; NEVER BLOCKS ON THE MIXER
+        Args:
+                category   : (int,   required) CUE, ENCOURAGEMENT or BEEP.
+                timestamp  : (float, optional) perf_counter time of request. Defaults to now.
+        '''
+
+        if timestamp is None:
+            timestamp = perf_counter()
+
+        with self.cond:
+            if len(self.heap) >= self.capacity:
+                # drop lowest priority, newest request
+                worst = max(self.heap)
+                if worst[0] <= category:
+                    self.dropped[category] += 1
+                    return
+                self.heap.remove(worst)
+                heapq.heapify(self.heap)
+                self.dropped[worst[0]] += 1
+
+            heapq.heappush(self.heap, (category, self.seq, timestamp))
+            self.seq += 1
+            self.cond.notify()
+
+    def play(self, category, timestamp):
+        ''' PLAY SOUND OF REQUEST ON ITS RESERVED CHANNEL
+        Args:
+                category   : (int,   required) CUE, ENCOURAGEMENT or BEEP.
+                timestamp  : (float, required) perf_counter time of request.
+        '''
+
+        if timestamp - self.last_played[category] < RATE_LIMITS[category]:
+            self.limited[category] += 1
+            return
+
+        channel = CATEGORY_CHANNELS[category]
+        if self.channels[channel].get_busy() and self.playing[channel] is not None and self.playing[channel] < category:
+            self.busy[category] += 1
+            return
+
+        # sound of current language picked here, not by the caller
+        if category == BEEP:
+            sound_path = self.sound_bank.beep
+        else:
+            sounds = self.sound_bank.bundle[CATEGORY_NAMES[category]]
+            if len(sounds) == 0:
+                return
+            sound_path = choice(sounds)
+
+        self.channels[channel].play(self.sound_bank.get(sound_path))
+        self.playing[channel] = category
+        self.last_played[category] = timestamp
+        self.log.append((category, timestamp, perf_counter()))
+
+    def run(self):
+        ''' DISPATCHER LOOP; RUNS ON BACKGROUND THREAD
+
+        '''
+
+        while True:
+            with self.cond:
+                while self.running and len(self.heap) == 0:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                [category, seq, timestamp] = heapq.heappop(self.heap)
+
+            self.play(category, timestamp)
+
+    def getLatency(self):
+        ''' GET MEASURED TIME FROM REQUEST TO PLAYBACK
+
+        Returns:
+                latency  : (dict) Queue depth; and for each category name, sounds played,
+                           requests dropped from a full queue, rate limited or refused by
+                           a busy channel, and mean and largest latency in ms.
+        '''
+
+        log = np.array(self.log).reshape(-1, 3)
+        latency = {"depth" : len(self.heap)}
+        for category, name in CATEGORY_NAMES.items():
+            delay = (log[log[:,0] == category, 2] - log[log[:,0] == category, 1]) * 1000
+            latency[name] = {
+                "played" : len(delay),
+                "dropped" : self.dropped[category],
+                "limited" : self.limited[category],
+                "busy" : self.busy[category],
+                "mean_ms" : np.mean(delay) if len(delay) > 0 else None,
+                "max_ms" : np.max(delay) if len(delay) > 0 else None,
+            }
+
+        return latency
+
+    def close(self):
+        ''' STOP BACKGROUND THREAD; WAITING REQUESTS ARE DISCARDED
+
+        '''
+
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.thread.join()
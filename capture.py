@@ -0,0 +1,290 @@
+'''
+__author       = "Chen Si-En, Sarah"
+__copyright    = "Copyright 2021, Chen Si-En, Sarah"
+
+__description  = "Threaded latest-frame capture sources for Pi camera and webcam"
+__version      = "1.2.0"
+__status       = "Production"
+__dependencies = "cv2, numpy, picamera"
+'''
+
+import threading
+from abc import ABC, abstractmethod
+import cv2
+import numpy as np
+from time import sleep, perf_counter
+
+class FrameSource(ABC):
+    ''' LATEST-FRAME CAPTURE SOURCE
+            A background thread captures frames into a small ring buffer of preallocated
+            slots and keeps only the newest one. read() always returns the freshest frame;
+            frames the reader was too slow for are dropped instead of queueing up. Camera
+            backends subclass it and implement run(). The rate of published frames can be
+            limited; frames in between are dropped on the capture thread before conversion.
+    Args:
+            camera             : (camera obj,   required) Camera object created in main.py
+            camera_resolution  : (arr of 2 int, required) Camera resolution in pixels
+            buffer_size        : (int,          optional) Number of ring buffer slots. Defaults to 3.
+            gray               : (bool,         optional) Capture grayscale (luminance) frames. Defaults to False.
+    '''
+
+    def __init__(self, camera, camera_resolution, buffer_size=3, gray=False):
+        self.camera = camera
+        self.camera_resolution = camera_resolution
+        self.gray = gray
+
+        # ring buffer; one slot being written, one held by reader, one holding newest frame
+        self.buffer_size = max(3, buffer_size)
+        self.buffer = [self.allocate() for i in range(0, self.buffer_size)]
+        self.newest = None
+        self.held = None
+        self.frame_count = 0
+        self.read_count = 0
+
+        # rate limit; a frame that changed from the last published one may wake it early
+        self.frame_period = 0.0
+        self.wake_threshold = None
+        self.next_frame_time = 0.0
+        self.signature_size = (32, 24)
+        self.signature = None
+
+        # threading
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def allocate(self):
+        ''' ALLOCATE ONE RING BUFFER SLOT
+
+        Returns:
+                slot  : (arr) Empty frame.
+        '''
+
+        if self.gray:
+            return np.empty((self.camera_resolution[1], self.camera_resolution[0]), dtype=np.uint8)
+        return np.empty((self.camera_resolution[1], self.camera_resolution[0], 3), dtype=np.uint8)
+
+    def start(self):
+        ''' START BACKGROUND CAPTURE THREAD
+
+        '''
+
+        if self.running:
+            return
+
+        self.newest = None
+        self.held = None
+        self.frame_count = 0
+        self.read_count = 0
+        self.next_frame_time = 0.0
+        self.signature = None
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        ''' STOP BACKGROUND CAPTURE THREAD
+
+        '''
+
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def setFrameRate(self, rate, wake_threshold=None):
+        ''' LIMIT RATE OF PUBLISHED FRAMES
+                Frames captured before the next one is due are dropped by the capture thread
+                before any conversion. With a wake_threshold, a tiny signature of each such
+                frame is compared with that of the last published frame, and a frame with
+                any signature cell changed by at least the threshold is published at once,
+                so a marker coming into view is not held back by the rate limit.
+        Args:
+                rate            : (float, required) Frames per second; None for every frame.
+                wake_threshold  : (float, optional) Largest gray-level change of a signature cell
+                                  publishing a frame early. Defaults to None (off).
+        '''
+
+        self.frame_period = 1.0/rate if rate else 0.0
+        self.wake_threshold = wake_threshold
+        self.next_frame_time = min(self.next_frame_time, perf_counter() + self.frame_period)
+        self.signature = None
+
+    def getSignature(self, image):
+        ''' TINY GRAY COPY OF FRAME FOR CHANGE DETECTION
+        Args:
+                image      : (arr, required) Gray or BGR frame.
+
+        Returns:
+                signature  : (arr) Downsampled gray frame.
+        '''
+
+        signature = cv2.resize(image, self.signature_size, interpolation=cv2.INTER_AREA)
+        if signature.ndim == 3:
+            signature = cv2.cvtColor(signature, cv2.COLOR_BGR2GRAY)
+
+        return signature
+
+    def isDue(self, image=None):
+        ''' CHECK IF CAPTURED FRAME SHOULD BE PUBLISHED
+        Args:
+                image  : (arr, optional) Captured frame, or None when its pixels are not read yet.
+
+        Returns:
+                due    : (bool) Whether the frame is due, or changed enough to publish early.
+        '''
+
+        if self.frame_period == 0.0 or perf_counter() >= self.next_frame_time:
+            return True
+        if image is None or self.wake_threshold is None or self.signature is None:
+            return False
+
+        return cv2.absdiff(self.getSignature(image), self.signature).max() >= self.wake_threshold
+
+    def nextSlot(self):
+        ''' GET INDEX OF RING BUFFER SLOT TO WRITE NEXT FRAME INTO
+
+        Returns:
+                idx  : (int) Slot neither holding newest frame nor held by reader.
+        '''
+
+        with self.condition:
+            for idx in range(0, self.buffer_size):
+                if idx != self.newest and idx != self.held:
+                    return idx
+
+    def publish(self, idx):
+        ''' MARK SLOT AS NEWEST FRAME AND WAKE READER
+        Args:
+                idx  : (int, required) Slot just written.
+        '''
+
+        if self.frame_period > 0.0:
+            self.next_frame_time = perf_counter() + self.frame_period
+            if self.wake_threshold is not None:
+                self.signature = self.getSignature(self.buffer[idx])
+
+        with self.condition:
+            self.newest = idx
+            self.frame_count += 1
+            self.condition.notify_all()
+
+    def read(self, timeout=1.0):
+        ''' GET NEWEST FRAME NOT YET READ
+        Args:
+                timeout  : (float, optional) Seconds to wait for a new frame. Defaults to 1.0.
+
+        Returns:
+                frame    : (arr) Newest frame, or None if no new frame arrived in time.
+                           Valid until the next call to read().
+        '''
+
+        with self.condition:
+            if self.frame_count == self.read_count:
+                self.condition.wait_for(lambda: self.frame_count != self.read_count or not self.running, timeout)
+            if self.frame_count == self.read_count:
+                return None
+
+            self.held = self.newest
+            self.newest = None
+            self.read_count = self.frame_count
+
+        return self.buffer[self.held]
+
+    @abstractmethod
+    def run(self):
+        ''' CAPTURE LOOP; RUNS ON BACKGROUND THREAD
+
+        '''
+
+class PiCameraFrameSource(FrameSource):
+    ''' LATEST-FRAME CAPTURE SOURCE FOR PI CAMERA
+            In gray mode, YUV420 frames from the video port are written straight into
+            preallocated buffers and each slot is a zero-copy view of the Y plane, so
+            neither BGR decoding nor colour conversion is needed.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        self.raw = []
+        FrameSource.__init__(self, *args, **kwargs)
+
+    def allocate(self):
+        if not self.gray:
+            return FrameSource.allocate(self)
+
+        # YUV420 planes are padded to a width multiple of 32 and height multiple of 16
+        [width, height] = self.camera_resolution
+        fwidth = (width + 31) // 32 * 32
+        fheight = (height + 15) // 16 * 16
+        raw = np.empty(fwidth * fheight * 3 // 2, dtype=np.uint8)
+        self.raw.append(raw)
+
+        return raw[:fwidth * fheight].reshape((fheight, fwidth))[:height, :width]
+
+    def outputs(self):
+        ''' YIELD RAW YUV BUFFERS TO CAPTURE INTO; PUBLISH EACH ONCE FILLED
+
+        '''
+
+        while self.running:
+            idx = self.nextSlot()
+            yield self.raw[idx]
+
+            # Y plane needs no conversion; a frame not due is overwritten by the next one
+            if self.isDue(self.buffer[idx]):
+                self.publish(idx)
+
+    def run(self):
+        if self.gray:
+            self.camera.capture_sequence(self.outputs(), format="yuv", use_video_port=True)
+            return
+
+        from picamera.array import PiRGBArray
+        rawCapture = PiRGBArray(self.camera, size=(self.camera_resolution[0], self.camera_resolution[1]))
+
+        for capture in self.camera.capture_continuous(rawCapture, format="bgr", use_video_port=True):
+            if not self.running:
+                break
+
+            if self.isDue(capture.array):
+                idx = self.nextSlot()
+                np.copyto(self.buffer[idx], capture.array)
+                self.publish(idx)
+
+            # openCV truncate to prevent resolution buffer length error
+            rawCapture.truncate(0)
+
+class WebcamFrameSource(FrameSource):
+    ''' LATEST-FRAME CAPTURE SOURCE FOR USB WEBCAM
+            Reading continuously on its own thread keeps the driver's frame queue drained,
+            so no backlog of stale frames builds up. In gray mode, frames are read into one
+            reused BGR buffer and converted straight into the preallocated gray slots on
+            the capture thread. Frames not due are only grabbed, not decoded, unless they
+            may wake the source early.
+    '''
+
+    def run(self):
+        bgr = np.empty((self.camera_resolution[1], self.camera_resolution[0], 3), dtype=np.uint8)
+
+        while self.running:
+            if self.wake_threshold is None and not self.isDue():
+                self.camera.grab()
+                continue
+
+            idx = self.nextSlot()
+            ret, frame = self.camera.read(bgr if self.gray else self.buffer[idx])
+            if not ret:
+                sleep(0.01)
+                continue
+            if self.gray:
+                bgr = frame
+            if not self.isDue(frame):
+                continue
+
+            if self.gray:
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.buffer[idx])
+            if frame is not self.buffer[idx]:
+                self.buffer[idx] = frame
+            self.publish(idx)
@@ -0,0 +1,272 @@
+'''
+__author       = "Chen Si-En, Sarah"
+__copyright    = "Copyright 2021, Chen Si-En, Sarah"
+
+__description  = "Session recorder and memory-mapped columnar session files for camera and IMU data"
+__version      = "1.2.0"
+__status       = "Production"
+__dependencies = "numpy"
+'''
+
+import os
+import logging
+import threading
+import numpy as np
+from collections import deque
+from time import time
+
+logger = logging.getLogger(__name__)
+
+# event sources; IMU sources match the leg number sent by the Arduino
+SOURCE_LEFT_IMU = 0
+SOURCE_RIGHT_IMU = 1
+SOURCE_CAMERA = 2
+
+# session columns, one append-only file each; state is -1 for IMU events,
+# gyro values are NaN for camera events
+SESSION_COLUMNS = [('timestamp', '<f8'), \
+                   ('source', 'u1'), \
+                   ('state', 'i1'), \
+                   ('gx', '<f4'), \
+                   ('gy', '<f4'), \
+                   ('gz', '<f4')]
+EVENT_DTYPE = np.dtype(SESSION_COLUMNS)
+
+class SessionRecorder(object):
+    ''' THREAD-SAFE SESSION RECORDER
+            Each source (camera, left IMU, right IMU) has its own bounded queue and lock,
+            so logging an event is one deque append under an uncontended lock and never
+            blocks on another source. The lock orders each append against session stop,
+            so no event accepted by a session is ever left behind by its final write. One
+            writer thread drains all queues in batches, merges them in time order, appends
+            each field to its own column file in the session directory and hands the batch
+            to the session listener, if any; a listener that raises is logged and detached,
+            and recording goes on without it. Sessions are started and stopped explicitly;
+            events arriving outside a session, or while a queue is full, are dropped and
+            counted. Nothing is ever written to sys.stdout.
+    Args:
+            capacity        : (int,   optional) Maximum events waiting in each source queue. Defaults to 4096.
+            flush_interval  : (float, optional) Seconds between batch writes. Defaults to 0.5.
+    '''
+
+    def __init__(self, capacity=4096, flush_interval=0.5):
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.sources = [SOURCE_LEFT_IMU, SOURCE_RIGHT_IMU, SOURCE_CAMERA]
+
+        # per-source queues and counters
+        self.queues = {source: deque() for source in self.sources}
+        self.locks = {source: threading.Lock() for source in self.sources}
+        self.written = {source: 0 for source in self.sources}
+        self.dropped = {source: 0 for source in self.sources}
+        self.invalid = 0
+
+        self.recording = False
+        self.files = None
+        self.listener = None
+        self.thread = None
+        self.wake = threading.Event()
+
+    def start(self, path, listener=None):
+        ''' START NEW SESSION AND WRITER THREAD
+        Args:
+                path      : (string, required) Session directory; column files in it are overwritten.
+                listener  : (obj,    optional) Object whose update(records) is called with every
+                            written batch, on the writer thread, e.g. a gait.GaitAnalyzer.
+        '''
+
+        self.stop()
+
+        for source in self.sources:
+            self.queues[source].clear()
+            self.written[source] = 0
+            self.dropped[source] = 0
+        self.invalid = 0
+        self.listener = listener
+
+        os.makedirs(path, exist_ok=True)
+        self.files = {name: open(os.path.join(path, name + '.col'), 'wb') for name, dtype in SESSION_COLUMNS}
+        self.wake.clear()
+        self.recording = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        ''' STOP SESSION; WRITE REMAINING EVENTS AND CLOSE COLUMN FILES
+
+        '''
+
+        if self.thread is None:
+            return
+
+        # after this, no producer can append to the queues
+        for source in self.sources:
+            with self.locks[source]:
+                self.recording = False
+        self.wake.set()
+        self.thread.join()
+        self.thread = None
+
+        self.flush()
+        for f in self.files.values():
+            f.close()
+        self.files = None
+
+    def log(self, source, state=-1, gx=np.nan, gy=np.nan, gz=np.nan, timestamp=None):
+        ''' ADD EVENT TO SOURCE QUEUE
+        Args:
+                source     : (int,   required) SOURCE_LEFT_IMU, SOURCE_RIGHT_IMU or SOURCE_CAMERA.
+                state      : (int,   optional) Camera state, 1 if robot is moving else 0.
+                gx, gy, gz : (float, optional) Gyroscope values of IMU event.
+                timestamp  : (float, optional) Unix time of event. Defaults to now.
+        '''
+
+        queue = self.queues[source]
+        with self.locks[source]:
+            if not self.recording or len(queue) >= self.capacity:
+                self.dropped[source] += 1
+                return
+
+            queue.append((time() if timestamp is None else timestamp, source, state, gx, gy, gz))
+
+    def logCamera(self, state, timestamp=None):
+        ''' ADD CAMERA EVENT TO CAMERA QUEUE
+        Args:
+                state      : (int,   required) 1 if robot is moving else 0.
+                timestamp  : (float, optional) Unix time of event. Defaults to now.
+        '''
+
+        self.log(SOURCE_CAMERA, state, timestamp=timestamp)
+
+    def logIMU(self, line, timestamp=None):
+        ''' PARSE IMU LINE "leg,gx,gy,gz" AND ADD IT TO QUEUE OF THAT LEG
+        Args:
+                line       : (string, required) Line received from Arduino IMU.
+                timestamp  : (float,  optional) Unix time of event. Defaults to now.
+        '''
+
+        if timestamp is None:
+            timestamp = time()
+
+        try:
+            [leg, gx, gy, gz] = line.split(',')
+            leg = int(leg)
+            if leg not in (SOURCE_LEFT_IMU, SOURCE_RIGHT_IMU):
+                raise ValueError
+            self.log(leg, -1, float(gx), float(gy), float(gz), timestamp)
+        except ValueError:
+            # status messages and partial lines
+            self.invalid += 1
+
+    def flush(self):
+        ''' APPEND ALL QUEUED EVENTS TO COLUMN FILES AS ONE TIME-ORDERED BATCH
+
+        '''
+
+        items = []
+        for source in self.sources:
+            queue = self.queues[source]
+            n = len(queue)
+
+            # popleft is safe against the producer appending concurrently
+            items.extend([queue.popleft() for i in range(0, n)])
+            self.written[source] += n
+
+        if len(items) == 0:
+            return
+
+        records = np.array(items, dtype=EVENT_DTYPE)
+        records = records[np.argsort(records['timestamp'], kind='stable')]
+        for name, dtype in SESSION_COLUMNS:
+            records[name].tofile(self.files[name])
+            self.files[name].flush()
+
+        if self.listener is not None:
+            try:
+                self.listener.update(records)
+            except Exception:
+                logger.exception('session listener failed; detached, recording goes on')
+                self.listener = None
+
+    def run(self):
+        ''' WRITER LOOP; RUNS ON BACKGROUND THREAD
+
+        '''
+
+        while self.recording:
+            self.wake.wait(self.flush_interval)
+            self.flush()
+
+    def getCounters(self):
+        ''' GET QUEUE COUNTERS
+
+        Returns:
+                counters  : (dict) Queue depth, and events written and dropped, of each source
+                            name; and number of invalid IMU lines.
+        '''
+
+        names = {SOURCE_LEFT_IMU: "left_imu", SOURCE_RIGHT_IMU: "right_imu", SOURCE_CAMERA: "camera"}
+        counters = {"invalid" : self.invalid}
+        for source in self.sources:
+            counters[names[source]] = {
+                "depth" : len(self.queues[source]),
+                "written" : self.written[source],
+                "dropped" : self.dropped[source],
+            }
+
+        return counters
+
+def openSession(path):
+    ''' OPEN SESSION COLUMNS AS READ-ONLY MEMORY-MAPPED ARRAYS
+            Nothing is read until the arrays are accessed, so even long sessions open
+            instantly and only the pages of the slices analysed are loaded. A session
+            still being recorded can be opened; columns are cut to the rows written to
+            every column file.
+    Args:
+            path     : (string, required) Session directory.
+
+    Returns:
+            columns  : (dict of arr) Array of each SESSION_COLUMNS field. Rows are in time
+                       order within each source, but rows of different sources only
+                       within each flush; sort on timestamp where that matters.
+    '''
+
+    sizes = {name: os.path.getsize(os.path.join(path, name + '.col')) // np.dtype(dtype).itemsize \
+             for name, dtype in SESSION_COLUMNS}
+    n = min(sizes.values())
+
+    columns = {}
+    for name, dtype in SESSION_COLUMNS:
+        if n == 0:
+            columns[name] = np.empty(0, dtype=dtype)
+        else:
+            columns[name] = np.memmap(os.path.join(path, name + '.col'), dtype=dtype, mode='r', shape=(n,))
+
+    return columns
+
+def findSessionRows(columns, start=None, end=None, margin=1.0):
+    ''' FIND ROWS OF SESSION COLUMNS IN TIME RANGE
+            Rows of a later flush are never more than margin seconds older than rows of an
+            earlier one, so a binary search on timestamp widened by margin bounds the rows
+            in range. Only the pages of the search and of the rows in bounds are read.
+    Args:
+            columns  : (dict of arr, required) Columns returned by openSession.
+            start    : (float, optional) Earliest unix time, inclusive. Defaults to None (session start).
+            end      : (float, optional) Latest unix time, exclusive. Defaults to None (session end).
+            margin   : (float, optional) Seconds rows may be out of order across flushes. Defaults to 1.0.
+
+    Returns:
+            rows     : (arr) Index of each row in range, in file order.
+    '''
+
+    timestamp = columns['timestamp']
+    lo = np.searchsorted(timestamp, start - margin) if start is not None else 0
+    hi = np.searchsorted(timestamp, end + margin) if end is not None else len(timestamp)
+
+    in_range = np.ones(max(hi - lo, 0), dtype=bool)
+    if start is not None:
+        in_range &= timestamp[lo:hi] >= start
+    if end is not None:
+        in_range &= timestamp[lo:hi] < end
+
+    return lo + np.flatnonzero(in_range)
@@ -5,14 +5,24 @@ __copyright    = "Copyright 2021, Chen Si-En, Sarah"
 __description  = "Functions for calculating gait parameters"
 __version      = "1.2.0"
 __status       = "Production"
-__dependencies = "pandas, scipy, global_params.py"
+__dependencies = "pandas, scipy, global_params.py, eventlog.py"
 '''
 
+import io
+import csv
 import glob
+import logging
+from functools import lru_cache
 import pandas as pd
 import numpy as np
-from scipy.signal import butter, lfilter, find_peaks
-from ast import literal_eval
+from scipy.signal import butter, sosfilt, find_peaks
+from eventlog import openSession, findSessionRows, SOURCE_LEFT_IMU, SOURCE_RIGHT_IMU, SOURCE_CAMERA
+
+logger = logging.getLogger(__name__)
+
+# nominal IMU sample rate of the Arduino sketch, delay(50); gaps are never shorter than
+# gap_periods of its sample period, so Bluetooth bursts are not taken for gaps
+IMU_SAMPLE_RATE = 20
 
 def vector_magnitude(data):
     ''' FIND VECTOR MAGNITUDE OF 3D VECTOR, V, WHERE V = (X, Y, Z)
@@ -31,65 +41,386 @@ def vector_magnitude(data):
     res = np.sqrt(data[:,0]**2 + data[:,1]**2 + data[:,2]**2)
     return res
 
-def butterworth(fc, fs, od, data):
+@lru_cache(maxsize=None)
+def butterworthSOS(fc, fs, od):
+    ''' BUTTERWORTH LOW-PASS COEFFICIENTS AS SECOND-ORDER SECTIONS; COMPUTED ONCE PER DESIGN
+    
+    Args:
+      fc     : (int,  required)  Given cutoff frequency.
+      fs     : (int,  required)  Given sampling frequency.
+      od     : (int,  required)  Given order of filter.
+    
+    Returns:
+      sos    : (arr)  Second-order sections.
+    '''
+
+    return butter(od, fc/(fs/2), output='sos')
+
+def butterworth(fc, fs, od, data, axis=-1):
     ''' BUTTERWORTH FILTER
     
     Args:
       fc     : (int,  required)  Given cutoff frequency.
       fs     : (int,  required)  Given sampling frequency.
       od     : (int,  required)  Given order of filter.
-      data   : (arr,  required)  Given signal data.
+      data   : (arr,  required)  Given signal data; one signal per row if 2-D.
+      axis   : (int,  optional)  Given axis to filter along. Defaults to -1.
     
     Returns:
       filtered_data  : (arr)  Filtered signal.
     '''
     
-    [b,a] = butter(od,fc/(fs/2))
-    filtered_data = lfilter(b,a,data)
+    filtered_data = sosfilt(butterworthSOS(fc, fs, od), data, axis=axis)
     
     return filtered_data
 
-def getCadenceStrideTime():
-    ''' GET CADENCE AND STRIDE TIME FROM IMU OR CAMERA DATA
+def estimateSampleRate(timestamp, gap_periods=5):
+    ''' ESTIMATE SAMPLE RATE FROM HOST TIMESTAMPS
+            Mean rate over the session with gaps left out, so bursty delivery averages
+            out and pauses in the stream do not lower the estimate.
+    
+    Args:
+      timestamp    : (arr,  required)  Given host times of samples.
+      gap_periods  : (int,  optional)  Sample periods without data counted as a gap. Defaults to 5.
+    
+    Returns:
+      fs           : (float)  Sample rate, or None if it cannot be estimated.
+    '''
+
+    interval = np.diff(timestamp)
+    if len(interval) == 0 or timestamp[-1] <= timestamp[0]:
+        return None
+
+    # first estimate counts gaps, so its gap threshold is too long rather than too short
+    fs = len(interval) / (timestamp[-1] - timestamp[0])
+    regular = interval <= gap_periods / fs
+    if np.sum(interval[regular]) <= 0:
+        return None
+
+    return np.count_nonzero(regular) / np.sum(interval[regular])
+
+def resampleUniform(timestamp, data, fs, max_gap):
+    ''' LINEARLY INTERPOLATE SAMPLES ONTO UNIFORM GRID; NO GRID SAMPLES IN GAPS
+            Samples are split into segments wherever there is no data for longer than
+            max_gap, and each segment gets its own grid starting at its first sample.
+    
+    Args:
+      timestamp  : (arr,    required)  Given increasing host times of samples.
+      data       : (arr,    required)  Given sample values.
+      fs         : (float,  required)  Given frequency of grid.
+      max_gap    : (float,  required)  Given longest time without data within a segment.
+    
+    Returns:
+      values     : (arr)  Values on grid.
+      segment    : (arr)  Segment number of each grid sample.
+    '''
+
+    breaks = np.flatnonzero(np.diff(timestamp) > max_gap) + 1
+    starts = np.concatenate([[0], breaks])
+    ends = np.concatenate([breaks, [len(timestamp)]]) - 1
+
+    ## grid sample k of segment at start time + k/fs
+    n = np.floor((timestamp[ends] - timestamp[starts]) * fs).astype(int) + 1
+    segment = np.repeat(np.arange(0, len(starts)), n)
+    k = np.arange(0, np.sum(n)) - np.repeat(np.cumsum(n) - n, n)
+    grid = timestamp[starts][segment] + k / fs
+
+    return np.interp(grid, timestamp, data), segment
+
+def findValleys(filtered, prominence=15, distance=20, wlen=600):
+    ''' GAIT EVENTS AS VALLEYS OF FILTERED GYROSCOPE MAGNITUDE
+            Prominence is measured within wlen samples centred on each valley, so it is
+            known once valleyReach(wlen) newer samples have arrived. The distance rule keeps
+            the deepest of local minima closer than distance first, so minima on either
+            side of a gap of at least distance between local minima do not affect each
+            other; the streaming analyzer decides valleys up to the last such gap.
+    
+    Args:
+      filtered    : (arr,  required)  Given filtered magnitudes of one segment.
+      prominence  : (int,  optional)  Minimum valley prominence. Defaults to 15.
+      distance    : (int,  optional)  Minimum samples between valleys. Defaults to 20.
+      wlen        : (int,  optional)  Samples around each valley its prominence is measured in. Defaults to 600.
+    
+    Returns:
+      valleys     : (arr)  Sample index of each valley.
+    '''
+
+    return find_peaks(-filtered, prominence=prominence, distance=distance, wlen=wlen)[0]
+
+def valleyReach(wlen):
+    ''' SAMPLES ON EITHER SIDE OF A LOCAL MINIMUM THAT DECIDE ITS PROMINENCE
+            Half the prominence window, plus the neighbour that makes it a local minimum.
+    
+    Args:
+      wlen   : (int,  required)  Given prominence window of findValleys.
+    
+    Returns:
+      reach  : (int)  Number of samples.
+    '''
+
+    return wlen//2 + 1
+
+def gaitKernel(timestamps, gyros, fc=2, fs=30, od=2, prominence=15, distance=20, wlen=600, gap_periods=5):
+    ''' CADENCE AND STRIDE TIME OF ALL LEGS AT ONCE
+            Each leg is resampled onto a uniform grid and split at gaps. All segments of
+            all legs are laid out as rows of one 2-D array and filtered in a single call;
+            valleys are then found per row and strides taken as differences of valley
+            positions.
+    
+    Args:
+      timestamps   : (arr of arr,  required)  Given host times of samples of each leg.
+      gyros        : (arr of arr,  required)  Given gyroscope samples [gx, gy, gz] of each leg.
+      fc           : (int,  optional)  Filter cutoff frequency. Defaults to 2.
+      fs           : (int,  optional)  Frequency of resampling grid. Defaults to 30.
+      od           : (int,  optional)  Filter order. Defaults to 2.
+      prominence   : (int,  optional)  Minimum valley prominence. Defaults to 15.
+      distance     : (int,  optional)  Minimum grid samples between valleys. Defaults to 20.
+      wlen         : (int,  optional)  Grid samples around each valley its prominence is measured in. Defaults to 600.
+      gap_periods  : (int,  optional)  Sample periods without data ending a segment. Defaults to 5.
+    
+    Returns:
+      res          : (dict)  "legs": cadence, stride_time and strides (arr, s) of each leg;
+                             "cadence" and "stride_time" of legs combined. Values are None
+                             where there are no valleys or strides.
+    '''
+
+    ## resample legs into segments
+    rows = []
+    row_leg = []
+    for leg in range(0, len(timestamps)):
+        timestamp = np.asarray(timestamps[leg], dtype=np.float64)
+        if len(timestamp) == 0:
+            continue
+
+        sample_rate = estimateSampleRate(timestamp, gap_periods)
+        max_gap = gap_periods / min(sample_rate, IMU_SAMPLE_RATE) if sample_rate != None else np.inf
+        values, segment = resampleUniform(timestamp, vector_magnitude(np.asarray(gyros[leg], dtype=np.float64)), fs, max_gap)
+
+        segments = np.split(values, np.flatnonzero(np.diff(segment)) + 1)
+        rows.extend(segments)
+        row_leg.extend([leg] * len(segments))
+
+    ## filter all segments in one call; padding after a segment does not affect it
+    lengths = np.array([len(row) for row in rows], dtype=int)
+    block = np.zeros((len(rows), lengths.max() if len(rows) > 0 else 0))
+    block[np.arange(block.shape[1]) < lengths[:,None]] = np.concatenate(rows) if len(rows) > 0 else []
+    filtered = butterworth(fc, fs, od, block, axis=1)
+
+    ## valleys and strides of each segment
+    valleys = [findValleys(filtered[i,:lengths[i]], prominence, distance, wlen) for i in range(0, len(rows))]
+    row_leg = np.array(row_leg, dtype=int)
+
+    legs = []
+    for leg in range(0, len(timestamps)):
+        leg_rows = np.flatnonzero(row_leg == leg)
+        num_valleys = sum(len(valleys[i]) for i in leg_rows)
+        strides = np.concatenate([np.diff(valleys[i]) for i in leg_rows] + [np.empty(0)]) / fs
+        legs.append({
+            "cadence" : num_valleys+1 if num_valleys != 0 else None,
+            "stride_time" : np.mean(strides) if len(strides) != 0 else None,
+            "strides" : strides,
+        })
+
+    return {
+        "legs" : legs,
+        "cadence" : getLegData(*[leg["cadence"] for leg in legs]),
+        "stride_time" : getLegData(*[leg["stride_time"] for leg in legs]),
+    }
+
+def getLegData(*values):
+    ''' COMBINE VALUES OF ANY NUMBER OF LEGS; MEAN OF THOSE AVAILABLE
+    
+    Args:
+      values  : (float,  required)  Given value of each leg, e.g. left and right, or None.
+    
+    Returns:
+      res     : (float)  Combined value, or None if no leg has one.
+    '''
+
+    values = [value for value in values if value != None]
+    if len(values) == 0:
+        return None
+
+    return np.mean(values)
+
+def findCameraTransitions(state):
+    ''' FIND START (0 TO 1) AND STOP (1 TO 0) TRANSITIONS OF CAMERA STATES
+    
+    Args:
+      state     : (arr,  required)  Given camera states, 1 if robot is moving else 0.
+    
+    Returns:
+      idx       : (arr)  Row i of each transition, between rows i and i+1.
+      is_start  : (arr)  Whether each transition is a start.
+    '''
+
+    change = np.diff(np.asarray(state))
+    idx = np.flatnonzero((change == 1) | (change == -1))
+
+    return idx, change[idx] == 1
+
+def pairCameraRuns(idx, is_start, thres=3):
+    ''' PAIR CONSECUTIVE TRANSITIONS INTO MOVING RUNS
+            Transitions of a 0/1 state alternate, so consecutive transitions are paired; a
+            pair starting with a stop gives a negative length and is discarded, as is any
+            run shorter than thres rows. An odd last transition is left unpaired.
+    
+    Args:
+      idx       : (arr,  required)  Given rows of transitions, in order.
+      is_start  : (arr,  required)  Given whether each transition is a start.
+      thres     : (int,  optional)  Minimum rows in a run. Defaults to 3.
+    
+    Returns:
+      stop      : (arr)  Position in idx of the stop transition of each run kept.
+      num_used  : (int)  Number of transitions paired.
+    '''
+
+    n = len(idx) // 2
+    first = np.arange(0, 2*n, 2)
+    second = first + 1
+    start = np.where(is_start[first], first, second)
+    stop = np.where(is_start[first], second, first)
+
+    keep = idx[stop] - idx[start] >= thres
+
+    return stop[keep], 2*n
+
+def segmentCameraRuns(state, timestamp, thres=3):
+    ''' FIND MOVING RUNS OF CAMERA DATA; CADENCE AND STRIDE TIME FROM THEIR STOP TIMES
+            A run is a start (0 to 1) transition paired with the following stop (1 to 0)
+            transition; see pairCameraRuns.
+    
+    Args:
+      state        : (arr,  required)  Given camera states, 1 if robot is moving else 0.
+      timestamp    : (arr,  required)  Given times of camera rows.
+      thres        : (int,  optional)  Minimum rows in a run. Defaults to 3.
+    
+    Returns:
+      cadence      : (int)    Number of runs.
+      stride_time  : (float)  Mean time between run stops, or None if fewer than 2 runs.
+      stop_time    : (arr)    Time of each run stop.
+    '''
+
+    timestamp = np.asarray(timestamp)
+
+    idx, is_start = findCameraTransitions(state)
+    stop, _ = pairCameraRuns(idx, is_start, thres)
+    stop_time = np.sort(timestamp[idx[stop] + 1], kind='stable')
+
+    if len(stop_time) > 1:
+        stride_time = np.mean(np.diff(stop_time))
+    else:
+        stride_time = None
+
+    return len(stop_time), stride_time, stop_time
+
+def readLegacyCsv(path):
+    ''' READ SESSION PRINTED TO datafile.csv BY EARLIER VERSIONS; DROP MALFORMED LINES
+            Rows are "time,leg,gx,gy,gz" (IMU) or "time,state,," (camera). All lines are
+            parsed as text in one pass, then converted to numbers column by column.
+            Console messages, partial lines and rows of neither form are dropped.
+    
+    Args:
+      path         : (string,  required)  Given path to csv file.
     
+    Returns:
+      data         : (DataFrame)  Columns [time, leg or camera state, gx, gy, gz]; gyro values
+                                  are NaN for camera rows.
+      num_dropped  : (int)        Number of malformed lines dropped.
+    '''
+
+    with open(path) as f:
+        text = f.read()
+    lines = text.split('\n')
+    num_lines = len(lines) - lines.count('')
+
+    # console messages may contain quotes; no field is quoted
+    raw = pd.read_csv(io.StringIO(text), header=None, names=range(5), dtype=str, quoting=csv.QUOTE_NONE, \
+                      on_bad_lines='skip', skip_blank_lines=True)
+    data = raw.apply(pd.to_numeric, errors='coerce')
+
+    ## valid rows
+    is_time = np.isfinite(data[0])
+    is_imu = data[1].isin([0, 1]) & data[[2, 3, 4]].notna().all(axis=1)
+    is_camera = data[1].isin([0, 1]) & raw[[2, 3, 4]].isna().all(axis=1)
+    data = data[is_time & (is_imu | is_camera)]
+
+    return data, num_lines - len(data)
+
+def readSessionFrames(path, start=None, end=None):
+    ''' READ CAMERA AND IMU ROWS OF SESSION AS TABLES LAID OUT LIKE PRINTED datafile.csv
+            Only the rows in the time range are read and copied, so memory grows with the
+            slice analysed, not with the session.
+    
+    Args:
+      path   : (string,  required)  Given path to session directory.
+      start  : (float,   optional)  Given earliest unix time, inclusive. Defaults to None (session start).
+      end    : (float,   optional)  Given latest unix time, exclusive. Defaults to None (session end).
+    
+    Returns:
+      cam_data        : (DataFrame)  Columns [time, camera state].
+      left_imu_data   : (DataFrame)  Columns [time, leg, gx, gy, gz] of left leg.
+      right_imu_data  : (DataFrame)  Columns [time, leg, gx, gy, gz] of right leg.
+    '''
+
+    # memory-mapped; only rows in range are copied out
+    columns = openSession(path)
+    rows = findSessionRows(columns, start, end)
+    columns = {name: columns[name][rows] for name in columns}
+    source = columns['source']
+
+    cam_rows = np.flatnonzero(source == SOURCE_CAMERA)
+    cam_data = pd.DataFrame({0: columns['timestamp'][cam_rows], \
+                             1: columns['state'][cam_rows]})
+
+    def legFrame(leg):
+        rows = np.flatnonzero(source == leg)
+        return pd.DataFrame({0: columns['timestamp'][rows], \
+                             1: source[rows], \
+                             2: columns['gx'][rows].astype(np.float64), \
+                             3: columns['gy'][rows].astype(np.float64), \
+                             4: columns['gz'][rows].astype(np.float64)})
+
+    return cam_data, legFrame(SOURCE_LEFT_IMU), legFrame(SOURCE_RIGHT_IMU)
+
+def getCadenceStrideTime(start=None, end=None):
+    ''' GET CADENCE AND STRIDE TIME FROM IMU OR CAMERA DATA OF RECORDED SESSION
+            Used offline and when the streaming analyzer failed during a session.
+    
+    Args:
+      start  : (float,  optional)  Given earliest unix time analysed. Defaults to None (session start).
+      end    : (float,  optional)  Given latest unix time analysed. Defaults to None (session end).
     '''
 
     ## get date
-    if len(glob.glob('datafile.csv')) == 0:
+    if len(glob.glob('datafile/*.col')) == 0 and len(glob.glob('datafile.csv')) == 0:
         return 'NA', 'NA'
     else:
         try:
-            data = pd.read_csv('datafile.csv', header=None)
+            if len(glob.glob('datafile/*.col')) > 0:
+                [cam_data, left_imu_data, right_imu_data] = readSessionFrames('datafile', start, end)
+            else:
+                # session printed to text file by earlier versions
+                data, num_dropped = readLegacyCsv('datafile.csv')
+                if num_dropped > 0:
+                    logger.warning('datafile.csv: dropped %d malformed lines', num_dropped)
+                if start is not None:
+                    data = data[data[0] >= start]
+                if end is not None:
+                    data = data[data[0] < end]
 
-            ## clean data
-            tmp = []
-            for i in range(0, len(data)):
+                ## assign data
                 try:
-                    if not ( isinstance(data.iloc[i,0],int) or \
-                        isinstance(data.iloc[i,0],float) ):
-                        tmp.append(i)
+                    cam_data = data[data[2].isna()]
                 except:
-                    try:
-                        if not ( isinstance( literal_eval(data.iloc[i,0]),int) or \
-                            isinstance( literal_eval(data.iloc[i,0]),float)):
-                            tmp.append(i)
-                    except:
-                        tmp.append(i)
-           
-            data = data.drop(tmp)
-
-            ## assign data
-            try:
-                cam_data = data[data[2].isna()]
-            except:
-                return 'NA', 'NA'
-            
-            try:
-                imu_data = data[~data[2].isna()]
-                left_imu_data = imu_data[imu_data[1] == 0]
-                right_imu_data = imu_data[imu_data[1] == 1]
-            except:
-                pass
+                    return 'NA', 'NA'
+                
+                try:
+                    imu_data = data[~data[2].isna()]
+                    left_imu_data = imu_data[imu_data[1] == 0]
+                    right_imu_data = imu_data[imu_data[1] == 1]
+                except:
+                    pass
         except:
              return 'NA', 'NA'
 
@@ -104,91 +435,20 @@ def getCadenceStrideTime():
         try:
             thres = 3
 
-            tmp = []
-            prev = None
-            curr = None
-
-            for i in range(0, len(cam_data)-1):
-                if cam_data.iloc[i,1] == 0 and cam_data.iloc[i+1,1] == 1:
-                    prev = i
-                    prev_time = cam_data.iloc[i+1,0]
-                
-                if cam_data.iloc[i,1] == 1 and cam_data.iloc[i+1,1] == 0:
-                    curr = i
-                    curr_time = cam_data.iloc[i+1,0]
-                    
-                if prev != None and curr != None:
-                    tmp.append([curr-prev, curr_time])
-                    prev = None
-                    curr = None
-            tmp = np.array(tmp)
-            tmp = tmp[tmp[:,0] >= thres]
-            tmp = np.array(sorted(tmp, key=lambda x:x[1]))
-
-            cam_stride_time = []
-            if len(tmp) > 1:
-                for i in range(0, len(tmp)-1):
-                    cam_stride_time.append(tmp[i+1,1]-tmp[i,1])
-                cam_stride_time = np.mean(cam_stride_time)
-            else:
-                cam_stride_time = None
-
-            cam_cadence = len(tmp)
+            cam_cadence, cam_stride_time, _ = segmentCameraRuns(cam_data[1].to_numpy(), \
+                                                                cam_data[0].to_numpy(), thres)
         except:
             pass
 
     ## analyze imu data
-    def perLeg(data):
-        fc = 2 # cutoff freq
-        fs = 30 # sampling freq
-        od = 2 # order
-        filtered_data = butterworth(fc, fs, od, vector_magnitude(data.to_numpy()))
-        
-        peaks, _ = find_peaks(-filtered_data, prominence=15, distance=20)
-        
-        leg_imu_stride_time = []
-        for i in range(0, len(peaks)-1):
-            leg_imu_stride_time.append(peaks[i+1] - peaks[i])
-            
-        if len(leg_imu_stride_time) != 0:
-            leg_imu_stride_time = np.mean(leg_imu_stride_time)
-        else:
-            leg_imu_stride_time = None
-        
-        if len(peaks) != 0:
-            leg_imu_cadence = len(peaks)+1
-        else:
-            leg_imu_cadence = None
-        
-        return leg_imu_cadence, leg_imu_stride_time
-
-    try:
-        if len(left_imu_data) != 0:
-            left_imu_cadence, left_imu_stride_time = perLeg(left_imu_data.iloc[:,2:5])
-        else:
-            left_imu_cadence, left_imu_stride_time = None, None
-    except:
-        left_imu_cadence, left_imu_stride_time = None, None
     try:
-        if len(right_imu_data) != 0:
-            right_imu_cadence, right_imu_stride_time = perLeg(right_imu_data.iloc[:,2:5])
-        else:
-            right_imu_cadence, right_imu_stride_time = None, None
+        imu = gaitKernel([left_imu_data.iloc[:,0].to_numpy(), right_imu_data.iloc[:,0].to_numpy()], \
+                         [left_imu_data.iloc[:,2:5].to_numpy(), right_imu_data.iloc[:,2:5].to_numpy()])
+        imu_cadence = imu["cadence"]
+        imu_stride_time = imu["stride_time"]
     except:
-        right_imu_cadence, right_imu_stride_time = None, None
-
-    def getLegData(left, right):
-        if left != None and right != None:
-            return np.mean([left, right])
-        elif left == None and right != None:
-            return right
-        elif left != None and right == None:
-            return left
-        else:
-            return None
-
-    imu_cadence = getLegData(left_imu_cadence, right_imu_cadence)
-    imu_stride_time = getLegData(left_imu_stride_time, right_imu_stride_time)
+        imu_cadence = None
+        imu_stride_time = None
 
     ## return cadence and stride time
     try:
@@ -203,4 +463,295 @@ def getCadenceStrideTime():
             else:
                 raise
         except:
-            return 'NA', 'NA'
\ No newline at end of file
+            return 'NA', 'NA'
+
+class GaitAnalyzer(object):
+    ''' STREAMING GAIT ANALYZER
+            Fed batches of session events while recording, so results are ready as soon
+            as the session stops. IMU magnitudes are resampled onto a uniform grid as they
+            arrive and go through a stateful Butterworth filter, valleys are found with
+            findValleys as in gaitKernel and decided once every sample that affects them
+            has arrived, and camera transitions are found and paired into runs as they
+            arrive, with the functions used by segmentCameraRuns. Only running counts and
+            sums, and one value per stride, are kept, so memory stays small however long
+            the session is; only a run of local minima all closer together than distance
+            keeps its samples until the run ends.
+            Results are laid out as those of gaitKernel.
+    Args:
+            fc           : (int, optional) Filter cutoff frequency. Defaults to 2.
+            fs           : (int, optional) Frequency of resampling grid. Defaults to 30.
+            od           : (int, optional) Filter order. Defaults to 2.
+            prominence   : (int, optional) Minimum valley prominence. Defaults to 15.
+            distance     : (int, optional) Minimum grid samples between valleys. Defaults to 20.
+            wlen         : (int, optional) Grid samples around each valley its prominence is measured in. Defaults to 600.
+            thres        : (int, optional) Minimum camera rows in a moving run. Defaults to 3.
+            gap_periods  : (int, optional) Sample periods without data that end a segment. Defaults to 5.
+    '''
+
+    def __init__(self, fc=2, fs=30, od=2, prominence=15, distance=20, wlen=600, thres=3, gap_periods=5):
+        self.sos = butterworthSOS(fc, fs, od)
+        self.fs = fs
+        self.prominence = prominence
+        self.distance = distance
+        self.wlen = wlen
+        self.thres = thres
+        self.gap_periods = gap_periods
+
+        # valleys are decided once the samples that decide their prominence have
+        # arrived, and only the samples that decide undecided valleys are kept
+        self.holdback = valleyReach(wlen)
+        self.context = valleyReach(wlen)
+
+        ## imu state per leg
+        self.legs = {}
+        for leg in (SOURCE_LEFT_IMU, SOURCE_RIGHT_IMU):
+            self.legs[leg] = {
+                "first_time" : None,    # first raw sample
+                "last_time" : None,     # last raw sample
+                "last_magnitude" : None,
+                "num_raw" : 0,          # all raw sample intervals, for rate over whole span
+                "num_intervals" : 0,    # regular raw sample intervals, for sample rate
+                "sum_intervals" : 0.0,
+                "segment_start" : None, # time of first grid sample of segment
+                "k" : 0,                # next grid sample of segment
+                "zi" : np.zeros((self.sos.shape[0], 2)),
+                "tail" : np.empty(0),   # filtered samples from tail_start onwards
+                "tail_start" : 0,
+                "num_samples" : 0,
+                "decided" : 0,          # samples before this index are done
+                "last_valley" : None,   # last valley of segment
+                "num_valleys" : 0,
+                "num_strides" : 0,
+                "sum_strides" : 0,
+                "strides" : [],         # arrays of strides in grid samples
+            }
+
+        ## camera state
+        self.cam_rows = 0
+        self.cam_last_state = None
+        self.cam_last_time = None
+        self.pending_idx = np.empty(0, dtype=int)   # unpaired transition, if any
+        self.pending_start = np.empty(0, dtype=bool)
+        self.pending_time = np.empty(0)
+        self.num_runs = 0
+        self.first_run_time = None  # earliest and latest run stop
+        self.last_run_time = None
+
+    def update(self, records):
+        ''' ADD BATCH OF SESSION EVENTS
+        Args:
+                records  : (arr, required) Time-ordered EVENT_DTYPE records.
+        '''
+
+        source = records['source']
+
+        for leg in (SOURCE_LEFT_IMU, SOURCE_RIGHT_IMU):
+            rows = np.flatnonzero(source == leg)
+            if len(rows) > 0:
+                data = np.stack([records['gx'][rows], records['gy'][rows], records['gz'][rows]], 1).astype(np.float64)
+                self.updateLeg(self.legs[leg], records['timestamp'][rows], vector_magnitude(data))
+
+        rows = np.flatnonzero(source == SOURCE_CAMERA)
+        if len(rows) > 0:
+            self.updateCamera(records['state'][rows], records['timestamp'][rows])
+
+    def updateLeg(self, leg, timestamp, magnitude):
+        ''' RESAMPLE AND FILTER NEW SAMPLES OF ONE LEG AND DETECT SETTLED VALLEYS
+        Args:
+                leg        : (dict, required) State of leg.
+                timestamp  : (arr,  required) Host times of new samples.
+                magnitude  : (arr,  required) New gyroscope magnitudes.
+        '''
+
+        if leg["last_time"] is not None:
+            interval = np.diff(np.concatenate([[leg["last_time"]], timestamp]))
+            first = False
+        else:
+            leg["first_time"] = timestamp[0]
+            interval = np.concatenate([[0.0], np.diff(timestamp)])
+            first = True
+        leg["num_raw"] += len(interval) - first
+
+        ## sample rate as in estimateSampleRate; the rate over the whole span so far counts
+        ## gaps, so its gap threshold is too long rather than too short and the spacing
+        ## within bursts never drives it
+        span = timestamp[-1] - leg["first_time"]
+        span_gap = self.gap_periods * span / leg["num_raw"] if leg["num_raw"] > 0 and span > 0 else np.inf
+        span_gap = max(span_gap, self.gap_periods / IMU_SAMPLE_RATE)
+        counted = interval <= span_gap
+        counted[0] &= not first
+        leg["num_intervals"] += np.count_nonzero(counted)
+        leg["sum_intervals"] += np.sum(interval[counted])
+
+        ## gaps by sample rate estimated so far
+        if leg["sum_intervals"] > 0:
+            max_gap = max(self.gap_periods * leg["sum_intervals"] / leg["num_intervals"], \
+                          self.gap_periods / IMU_SAMPLE_RATE)
+        else:
+            max_gap = span_gap
+        regular = interval <= max_gap
+        regular[0] &= not first
+
+        ## resample each run of samples between gaps
+        breaks = np.flatnonzero(~regular)
+        for start, end in zip(np.concatenate([[0], breaks]), np.concatenate([breaks, [len(timestamp)]])):
+            if start == end:
+                continue
+            if not regular[start]:
+                self.endSegment(leg)
+                leg["segment_start"] = timestamp[start]
+                leg["k"] = 0
+                xp = timestamp[start:end]
+                fp = magnitude[start:end]
+            else:
+                xp = np.concatenate([[leg["last_time"]], timestamp[start:end]])
+                fp = np.concatenate([[leg["last_magnitude"]], magnitude[start:end]])
+
+            k_end = int(np.floor((xp[-1] - leg["segment_start"]) * self.fs)) + 1
+            grid = leg["segment_start"] + np.arange(leg["k"], k_end) / self.fs
+            leg["k"] = max(leg["k"], k_end)
+            leg["last_time"] = xp[-1]
+            leg["last_magnitude"] = fp[-1]
+
+            if len(grid) > 0:
+                filtered, leg["zi"] = sosfilt(self.sos, np.interp(grid, xp, fp), zi=leg["zi"])
+                leg["tail"] = np.concatenate([leg["tail"], filtered])
+                leg["num_samples"] += len(filtered)
+                self.detectValleys(leg, leg["num_samples"] - self.holdback)
+
+    def endSegment(self, leg):
+        ''' DECIDE REMAINING VALLEYS OF SEGMENT; NEXT SAMPLES START A NEW ONE
+        Args:
+                leg  : (dict, required) State of leg.
+        '''
+
+        self.detectValleys(leg, leg["num_samples"])
+        leg["zi"] = np.zeros((self.sos.shape[0], 2))
+        leg["tail"] = np.empty(0)
+        leg["tail_start"] = leg["num_samples"]
+        leg["last_valley"] = None
+
+    def detectValleys(self, leg, limit):
+        ''' COUNT VALLEYS BEFORE limit NOT YET DECIDED; TRIM TAIL
+        Args:
+                leg    : (dict, required) State of leg.
+                limit  : (int,  required) Sample index up to which valleys may be decided.
+        '''
+
+        ## local minima closer than distance decide each other's valleys, so decide up to
+        ## the last gap of at least distance before limit only
+        if limit < leg["num_samples"]:
+            minima = find_peaks(-leg["tail"])[0] + leg["tail_start"]
+            minima = minima[minima < limit]
+            ends = minima[np.diff(np.concatenate([minima, [limit]])) >= self.distance]
+            limit = ends[-1] + 1 if len(ends) > 0 else leg["decided"]
+
+        if limit <= leg["decided"]:
+            return
+
+        peaks = findValleys(leg["tail"], self.prominence, self.distance, self.wlen)
+        peaks = peaks + leg["tail_start"]
+        peaks = peaks[(peaks >= leg["decided"]) & (peaks < limit)]
+
+        if len(peaks) > 0:
+            if leg["last_valley"] is not None:
+                peaks = np.concatenate([[leg["last_valley"]], peaks])
+            else:
+                leg["num_valleys"] += 1
+            leg["num_valleys"] += len(peaks) - 1
+            leg["num_strides"] += len(peaks) - 1
+            leg["sum_strides"] += peaks[-1] - peaks[0]
+            leg["strides"].append(np.diff(peaks))
+            leg["last_valley"] = peaks[-1]
+        leg["decided"] = limit
+
+        # keep context before undecided samples only
+        start = max(leg["tail_start"], limit - self.context)
+        leg["tail"] = leg["tail"][start - leg["tail_start"]:]
+        leg["tail_start"] = start
+
+    def updateCamera(self, states, timestamps):
+        ''' SEGMENT NEW CAMERA ROWS INTO MOVING RUNS
+        Args:
+                states      : (arr, required) Camera states, 1 if robot is moving else 0.
+                timestamps  : (arr, required) Times of camera rows.
+        '''
+
+        ## transitions of new rows and of the last earlier row to the first new one
+        if self.cam_last_state is not None:
+            state = np.concatenate([[self.cam_last_state], states])
+            timestamp = np.concatenate([[self.cam_last_time], timestamps])
+            offset = self.cam_rows - 1
+        else:
+            state = np.asarray(states)
+            timestamp = np.asarray(timestamps)
+            offset = 0
+        idx, is_start = findCameraTransitions(state)
+
+        ## pair with transition left unpaired by earlier rows
+        stop_time = timestamp[idx + 1]
+        idx = np.concatenate([self.pending_idx, idx + offset])
+        is_start = np.concatenate([self.pending_start, is_start])
+        stop_time = np.concatenate([self.pending_time, stop_time])
+        stop, num_used = pairCameraRuns(idx, is_start, self.thres)
+
+        # stride time is the mean gap of sorted stop times, so only the extremes are kept
+        if len(stop) > 0:
+            times = [stop_time[stop].min(), stop_time[stop].max()]
+            if self.first_run_time is not None:
+                times += [self.first_run_time, self.last_run_time]
+            self.first_run_time = min(times)
+            self.last_run_time = max(times)
+            self.num_runs += len(stop)
+
+        self.pending_idx = idx[num_used:]
+        self.pending_start = is_start[num_used:]
+        self.pending_time = stop_time[num_used:]
+        self.cam_last_state = state[-1]
+        self.cam_last_time = timestamp[-1]
+        self.cam_rows += len(states)
+
+    def getIMUResult(self):
+        ''' DECIDE REMAINING VALLEYS AND GET IMU RESULTS OF EACH LEG AND COMBINED
+        
+        Returns:
+                res  : (dict) As returned by gaitKernel; "legs": cadence, stride_time and
+                       strides (arr, s) of left and right leg; "cadence" and "stride_time"
+                       of legs combined.
+        '''
+
+        legs = []
+        for key in (SOURCE_LEFT_IMU, SOURCE_RIGHT_IMU):
+            leg = self.legs[key]
+            self.endSegment(leg)
+
+            legs.append({
+                "cadence" : leg["num_valleys"]+1 if leg["num_valleys"] > 0 else None,
+                "stride_time" : leg["sum_strides"] / leg["num_strides"] / self.fs if leg["num_strides"] > 0 else None,
+                "strides" : np.concatenate(leg["strides"] + [np.empty(0)]) / self.fs,
+            })
+
+        return {
+            "legs" : legs,
+            "cadence" : getLegData(*[leg["cadence"] for leg in legs]),
+            "stride_time" : getLegData(*[leg["stride_time"] for leg in legs]),
+        }
+
+    def getCadenceStrideTime(self):
+        ''' DECIDE REMAINING VALLEYS AND GET CADENCE AND STRIDE TIME
+                Same results as getCadenceStrideTime on the recorded session.
+        
+        Returns:
+                cadence      : (int)   Cadence, or 'NA'.
+                stride_time  : (float) Stride time, or 'NA'.
+        '''
+
+        imu = self.getIMUResult()
+        if imu["cadence"] != None and imu["stride_time"] != None:
+            return int(imu["cadence"]), round(imu["stride_time"],2)
+
+        if self.num_runs > 1:
+            cam_stride_time = (self.last_run_time - self.first_run_time) / (self.num_runs-1)
+            return int(self.num_runs), round(cam_stride_time,2)
+
+        return 'NA', 'NA'
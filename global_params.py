@@ -5,14 +5,16 @@ __copyright    = "Copyright 2021, Chen Si-En, Sarah"
 __description  = "Global parameters for Rehabot 2.0"
 __version      = "1.2.0"
 __status       = "Production"
-__dependencies = "pygame, alsaaudio" 
+__dependencies = "pygame, alsaaudio, eventlog.py, metronome.py, audio.py" 
 '''
 
-import glob
 import contextlib
 with contextlib.redirect_stdout(None):
     from pygame import mixer
 import alsaaudio
+from eventlog import SessionRecorder
+from metronome import Metronome
+from audio import SoundBank, AudioDispatcher, METRONOME_CHANNEL, RESERVED_CHANNELS
 
 def init():
     ''' INITIALIZE GLOBAL PARAMETERS
@@ -22,26 +24,38 @@ def init():
     ## global parameters to be shared
     global camera_status, robot_status, imu1_status, imu2_status, \
             camera, camera_resolution, \
-            robot, trackerFollower, \
+            robot, trackerFollower, marker_detector, tracker_state, \
             play_button_state, startFlag, stop_trackerFollower, \
             bpm, lang, volume, language, gui_lang, lang, \
-            cue, encouragement, beep, tick, mixer, speaker_mixer, \
-            recordIMU, stop_recordStream, \
+            cue, encouragement, beep, tick, mixer, speaker_mixer, sound_bank, \
+            recorder, metronome, audio_dispatcher, \
             sensitivity_level
     
-    # audio files
-    cue = glob.glob('rsc/audio/en_cue-*.wav')
-    encouragement = glob.glob('rsc/audio/en_encouragement-*.wav')
-    tick = glob.glob('rsc/audio/tick.wav')[0]
-    beep = glob.glob('rsc/audio/beep.wav')[0]
-    
     # Speaker mixer for volume control
     speaker_mixer = alsaaudio.Mixer() 
     mixer.init()
+
+    # audio files, decoded once; cue and encouragement of current language
+    sound_bank = SoundBank(mixer)
+    cue = sound_bank.bundle["cue"]
+    encouragement = sound_bank.bundle["encouragement"]
+    tick = sound_bank.tick
+    beep = sound_bank.beep
     
+    # marker detector of current session (set by trackerFollower)
+    marker_detector = None
+
+    # latest marker state and motor command (set in main.py)
+    tracker_state = None
+
     # initial metronome bpm setting
     bpm = 80
 
+    # metronome and audio dispatcher play on their own threads and reserved channels
+    mixer.set_reserved(RESERVED_CHANNELS)
+    metronome = Metronome(mixer.Channel(METRONOME_CHANNEL), sound_bank.get(tick), bpm)
+    audio_dispatcher = AudioDispatcher(sound_bank, mixer)
+
     # initial volume level setting
     volume = 100
 
@@ -53,7 +67,9 @@ def init():
     lang = 0
     startFlag = 0
     stop_trackerFollower = False
-    stop_recordStream = False
+
+    # session recorder for camera and IMU data
+    recorder = SessionRecorder()
     
     # default language
     language = 'ENGLISH'
@@ -78,5 +94,6 @@ def init():
                 "stride_time_units": "s",
                 "sensitivity": "Speed",
                 "sensitivity_desc": "Adjust robot speed",
+                "computing": "Computing...",
             }
     
\ No newline at end of file
@@ -9,21 +9,22 @@ __dependencies = "tkinter, global_params.py"
 '''
 
 import threading
+import queue
+import traceback
 import tkinter as tk
 import tkinter.font as font
 from tkinter import ttk
 from PIL import ImageTk, Image
-import glob 
 from datetime import datetime
 from time import mktime
 import csv
 from ast import literal_eval
 import global_params
-from gait import getCadenceStrideTime
+from gait import GaitAnalyzer, getCadenceStrideTime
+from audio import BEEP
 
 # threading
 t = None
-s = None
 
 # gui visual params
 background_color = '#4daff8'
@@ -83,6 +84,17 @@ def convertToUnixTime(val):
     except:
         return val
 
+def saveRecords(records_list):
+    ''' WRITE SESSION RECORDS TO CSV FILE
+    Args:
+        records_list  : (arr, required)  Records to save.
+    '''
+
+    with open('records.csv', 'w') as records_csv:
+        writer = csv.writer(records_csv)
+        writer.writerow(records_list)
+        records_csv.close()
+
 def statusIndicators(root):
     ''' GREEN/RED STATUS CIRCLE ICONS ON MAIN MENU
 
@@ -111,6 +123,7 @@ class appGUI(object):
 
     def __init__(self, root):
         self.root = root
+        self.session_results = queue.Queue()
         root.configure(bg=background_color)
 
         screen_width = root.winfo_screenwidth()
@@ -414,7 +427,7 @@ class appGUI(object):
         '''
 
         ## play beep when screen changes
-        global_params.mixer.Sound(global_params.beep).play()
+        global_params.audio_dispatcher.request(BEEP)
 
         ## remove all gui elements currently on screen
         self.RemoveAll()
@@ -437,7 +450,7 @@ class appGUI(object):
         '''
 
         ## play beep when screen changes
-        global_params.mixer.Sound(global_params.beep).play()
+        global_params.audio_dispatcher.request(BEEP)
         
         ## remove all gui elements currently on screen
         self.RemoveAll()
@@ -454,7 +467,7 @@ class appGUI(object):
         '''
 
         ## play beep when screen changes
-        global_params.mixer.Sound(global_params.beep).play()
+        global_params.audio_dispatcher.request(BEEP)
         
         ## remove all gui elements currently on screen
         self.RemoveAll()
@@ -499,9 +512,12 @@ class appGUI(object):
         ## refresh records table
         self.RefreshRecords(self.records_list)
 
-    def RefreshRecords(self, records_list):
+    def RefreshRecords(self, records_list, save=True):
         ''' REFRESH RECORDS TABLE
-            
+        Args:
+            self          : (Tkinter GUI object, required) 
+            records_list  : (arr, required)   Records to show.
+            save          : (bool, optional)  Also write records to csv file. Defaults to True.
         '''
         ## delete all existing records
         for i in self.records_table.get_children():
@@ -515,10 +531,8 @@ class appGUI(object):
         self.RecordsMenu
 
         ## update records csv file
-        with open('records.csv', 'w') as records_csv:
-            writer = csv.writer(records_csv)
-            writer.writerow(self.records_list)
-            records_csv.close()
+        if save:
+            saveRecords(self.records_list)
 
     def LanguageMenu(self):
         ''' DISPLAY LANGUAGE MENU ON CANVAS
@@ -526,7 +540,7 @@ class appGUI(object):
         '''
 
         ## play beep when screen changes
-        global_params.mixer.Sound(global_params.beep).play()
+        global_params.audio_dispatcher.request(BEEP)
         
         ## remove all gui elements currently on screen
         self.RemoveAll()
@@ -543,7 +557,7 @@ class appGUI(object):
         '''
 
         ## play beep when screen changes
-        global_params.mixer.Sound(global_params.beep).play()
+        global_params.audio_dispatcher.request(BEEP)
         
         ## remove all gui elements currently on screen
         self.RemoveAll()
@@ -559,7 +573,7 @@ class appGUI(object):
         '''
 
         ## play beep when screen changes
-        global_params.mixer.Sound(global_params.beep).play()
+        global_params.audio_dispatcher.request(BEEP)
         
         ## remove all gui elements currently on screen
         self.RemoveAll()
@@ -578,7 +592,7 @@ class appGUI(object):
         '''
 
         ## play beep when screen changes
-        global_params.mixer.Sound(global_params.beep).play()
+        global_params.audio_dispatcher.request(BEEP)
 
         ## remove all gui elements currently on screen
         self.RemoveAll()
@@ -594,7 +608,7 @@ class appGUI(object):
         '''
         
         ## play beep when screen changes
-        global_params.mixer.Sound(global_params.beep).play()
+        global_params.audio_dispatcher.request(BEEP)
 
         ## remove elements
         element_list = [\
@@ -656,9 +670,9 @@ class appGUI(object):
         '''
 
         ## play beep when screen changes
-        global_params.mixer.Sound(global_params.beep).play()
+        global_params.audio_dispatcher.request(BEEP)
         
-        global t, s, camera
+        global t, camera
         start_stop_flag = global_params.startFlag
         
         #### Session Started
@@ -672,6 +686,10 @@ class appGUI(object):
             ## toggles start/stop button
             self.start_button.configure(image=self.start_button_red_photo, text=global_params.gui_lang["stop"])
 
+            ## starts recording camera and IMU data; written and analyzed on recorder thread
+            self.gait_analyzer = GaitAnalyzer()
+            global_params.recorder.start('datafile', self.gait_analyzer)
+
             ## starts camera tracking and robot on separate thread
             global_params.stop_trackerFollower = False
             t = threading.Thread(target=global_params.trackerFollower, \
@@ -683,11 +701,6 @@ class appGUI(object):
                                 )
             t.start()
 
-            ## starts output recording on separate thread
-            global_params.stop_recordStream = False
-            s = threading.Thread(target=global_params.recordStream)
-            s.start()
-
             ## track session start time
             self.prev_session_start_time = datetime.now()
             
@@ -696,22 +709,8 @@ class appGUI(object):
         else:
             global_params.startFlag = 0
             
-            ## enable buttons; able to press
-            self.settings_button.configure(state='normal')
-            self.records_button.configure(state='normal')
-
-            ## toggles start/stop button
-            self.start_button.configure(image=self.start_button_green_photo, text=global_params.gui_lang["start"])
-            
-            ## stops camera tracking and robot, closes thread
-            global_params.stop_trackerFollower = True
-            t.join()
-
-            ## stops output recording, closes thread
-            global_params.stop_recordStream = True
-            f = open('datafile.csv', 'a')
-            f.close()
-            s.join()
+            ## toggles start/stop button; disabled until session is finalized
+            self.start_button.configure(image=self.start_button_green_photo, text=global_params.gui_lang["computing"], state='disable')
 
             ## track session stop time
             self.prev_session_stop_time = datetime.now()
@@ -724,30 +723,15 @@ class appGUI(object):
             self.duration_val = str(divmod(self.duration_in_s, 60)[0])
             self.duration_txt.set(self.duration_val + ' ' + global_params.gui_lang['duration_units'])
 
-            self.cadence_val, self.stride_time_val = getCadenceStrideTime()
-            self.cadence_txt.set(str(self.cadence_val) + ' ' + global_params.gui_lang['cadence_units'])
-            self.stride_time_txt.set(str(self.stride_time_val) + ' ' + global_params.gui_lang['stride_time_units'])
+            self.cadence_txt.set(global_params.gui_lang['computing'])
+            self.stride_time_txt.set(global_params.gui_lang['computing'])
 
-            ## add record to table
-            for i in range(0,8):
-                if self.records_list[i][1] == '-':
-                    self.records_list.remove(self.records_list[i])
-                    break
-                else:
-                    if i == 7:
-                        self.records_list.remove(self.records_list[-1])
-            record = (str(i+1), self.datetime_val, self.duration_val, str(self.cadence_val), str(self.stride_time_val))
-            self.records_list.append(record)
-            
-            self.records_list = sorted(self.records_list, reverse=True, key=lambda x: convertToUnixTime(x[1]))
-
-            for i in range(0, len(self.records_list)):
-                self.records_list[i] = list(self.records_list[i])
-                self.records_list[i][0] = i+1
-                self.records_list[i] = tuple(self.records_list[i])
-
-            ## refresh records table
-            self.RefreshRecords(self.records_list)
+            ## stops camera tracking, robot and recording and analyzes session on separate thread
+            global_params.stop_trackerFollower = True
+            f = threading.Thread(target=self.FinalizeSession, \
+                                 args=(t, self.gait_analyzer, self.datetime_val, self.duration_val, list(self.records_list)))
+            f.start()
+            self.root.after(100, self.ShowSessionResults)
 
         ## toggle status colors
         if global_params.camera_status:
@@ -762,6 +746,89 @@ class appGUI(object):
 
         return global_params.startFlag 
 
+    def FinalizeSession(self, tracker_thread, gait_analyzer, datetime_val, duration_val, records_list):
+        ''' STOP SESSION THREADS, GET GAIT RESULTS AND SAVE RECORDS; RUNS ON BACKGROUND THREAD
+                Results are put on the session results queue for ShowSessionResults, as
+                Tkinter widgets may only be used from the Tk thread. Results are always put,
+                NA on errors, so the GUI never waits forever.
+        Args:
+            self                     : (Tkinter GUI object, required) 
+            tracker_thread           : (Thread, required)  Camera tracking and robot thread.
+            gait_analyzer            : (GaitAnalyzer, required)  Analyzer of session.
+            datetime_val             : (str, required)  Session start date and time.
+            duration_val             : (str, required)  Session duration.
+            records_list             : (arr, required)  Copy of records before session.
+        '''
+
+        # shown if finalization fails
+        cadence_val = 'NA'
+        stride_time_val = 'NA'
+        results_list = list(records_list)
+
+        try:
+            ## stops camera tracking and robot, closes thread
+            tracker_thread.join()
+
+            ## stops recording, writes remaining data and closes file
+            global_params.recorder.stop()
+
+            try:
+                if global_params.recorder.listener is gait_analyzer:
+                    cadence_val, stride_time_val = gait_analyzer.getCadenceStrideTime()
+                else:
+                    # analyzer failed during session and was detached; analyze recorded session
+                    cadence_val, stride_time_val = getCadenceStrideTime()
+            except Exception:
+                # session is still recorded, with NA results
+                traceback.print_exc()
+
+            ## add record to table
+            for i in range(0,8):
+                if records_list[i][1] == '-':
+                    records_list.remove(records_list[i])
+                    break
+                else:
+                    if i == 7:
+                        records_list.remove(records_list[-1])
+            record = (str(i+1), datetime_val, duration_val, str(cadence_val), str(stride_time_val))
+            records_list.append(record)
+            
+            records_list = sorted(records_list, reverse=True, key=lambda x: convertToUnixTime(x[1]))
+
+            for i in range(0, len(records_list)):
+                records_list[i] = list(records_list[i])
+                records_list[i][0] = i+1
+                records_list[i] = tuple(records_list[i])
+
+            saveRecords(records_list)
+            results_list = records_list
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self.session_results.put((str(cadence_val), str(stride_time_val), results_list))
+
+    def ShowSessionResults(self):
+        ''' SHOW RESULTS OF FINALIZED SESSION; POLLS SESSION RESULTS QUEUE UNTIL THEY ARRIVE
+            
+        '''
+
+        try:
+            [self.cadence_val, self.stride_time_val, self.records_list] = self.session_results.get_nowait()
+        except queue.Empty:
+            self.root.after(100, self.ShowSessionResults)
+            return
+
+        self.cadence_txt.set(self.cadence_val + ' ' + global_params.gui_lang['cadence_units'])
+        self.stride_time_txt.set(self.stride_time_val + ' ' + global_params.gui_lang['stride_time_units'])
+
+        ## refresh records table; already saved
+        self.RefreshRecords(self.records_list, save=False)
+
+        ## enable buttons; able to press
+        self.settings_button.configure(state='normal')
+        self.records_button.configure(state='normal')
+        self.start_button.configure(text=global_params.gui_lang["start"], state='normal')
+
     def getLanguageVal(self, lang_val):
         ''' GETS CURRENT GUI LANGUAGE VALUE
         Args:
@@ -777,13 +844,16 @@ class appGUI(object):
         '''
 
         ## play beep when screen changes
-        global_params.mixer.Sound(global_params.beep).play()
+        global_params.audio_dispatcher.request(BEEP)
 
         lang = lang_val
 
+        ## swap audio bundle
+        bundle = global_params.sound_bank.setLanguage(lang)
+        global_params.cue = bundle["cue"]
+        global_params.encouragement = bundle["encouragement"]
+
         if lang == 0:
-            global_params.cue = glob.glob('rsc/audio/en_cue-*.wav')
-            global_params.encouragement = glob.glob('rsc/audio/en_encouragement-*.wav')
             
             global_params.language = 'ENGLISH'
             global_params.gui_lang = {
@@ -807,10 +877,9 @@ class appGUI(object):
                 "stride_time_units": "s",
                 "sensitivity": "Speed",
                 "sensitivity_desc": "Adjust robot speed",
+                "computing": "Computing...",
             }
         elif lang == 1:
-            global_params.cue = glob.glob('rsc/audio/cn_cue-*.wav')
-            global_params.encouragement = glob.glob('rsc/audio/cn_encouragement-*.wav')
             
             global_params.language = '中文'
             global_params.gui_lang = {
@@ -834,6 +903,7 @@ class appGUI(object):
                 "stride_time_units": "秒钟",
                 "sensitivity": "速度",
                 "sensitivity_desc": "调整机器人速度",
+                "computing": "计算中...",
             }
 
         ## changes gui elements to display in selected language
@@ -878,6 +948,7 @@ class appGUI(object):
 
         global metronome_val
         global_params.bpm = metronome_val.get()
+        global_params.metronome.setBpm(global_params.bpm)
         
         return global_params.bpm
 
@@ -893,6 +964,12 @@ class appGUI(object):
         ## Toggle metronome play status
         global_params.play_button_state = not global_params.play_button_state
 
+        ## Start/stop metronome service
+        if (global_params.play_button_state):
+            global_params.metronome.start()
+        else:
+            global_params.metronome.stop()
+
         ## Update metronome play button display image and text
         if (global_params.play_button_state):
             self.metronome_play_button.configure(image=self.metronome_pause_button_photo)
@@ -5,21 +5,23 @@ __copyright    = "Copyright 2021, Chen Si-En, Sarah"
 __description  = "Rehabot 2.0"
 __version      = "1.2.0"
 __status       = "Production"
-__dependencies = "cv2, alsaaudio, gpiozero, tkinter, global_params.py, robot.py, gui.py"
+__dependencies = "cv2, alsaaudio, gpiozero, tkinter, global_params.py, robot.py, capture.py, worker.py, motor.py, metronome.py, audio.py, gui.py"
 '''
 
 import tkinter as tk
-import time
 from gpiozero import Robot
+from motor import MotorController
 import RPi.GPIO as GPIO
 import cv2
 import global_params
 from gui import appGUI
-from os import remove
+from os import path, remove
 from glob import glob
 from serial import Serial
 from serial.threaded import ReaderThread
-from imu import SerialReaderProtocol, recordStream
+from imu import SerialReaderProtocol
+from robot import trackerFollower
+from worker import TrackerProcess, TrackerState
 
 ## status
 camera_status = False
@@ -28,7 +30,15 @@ imu1_status = False
 imu2_status = False
 
 # robot
-robot = Robot(left=(26,19), right=(13,6))
+def createRobot():
+    ''' CREATE GPIO ROBOT
+
+    Returns:
+            robot  : (MotorController) GPIO robot behind motor controller.
+    '''
+
+    return MotorController(Robot(left=(26,19), right=(13,6)))
+
 GPIO.setup(16, GPIO.OUT)
 GPIO.setup(20, GPIO.OUT)
 GPIO.output(16, GPIO.LOW)
@@ -37,31 +47,41 @@ GPIO.output(20, GPIO.LOW)
 # camera
 camera_resolution = [640, 480]
 camera_type = 0 # PiCamera: 0 | USB Webcam: 1
-if camera_type == 0:
-    try:
-        from picamera import PiCamera
-        camera = PiCamera()
-        camera.resolution = (camera_resolution[0], camera_resolution[1])
-        camera_status = True
-    except:
-        camera_status = False
-
-    from robot import trackerFollower_picamera as trackerFollower
-elif camera_type == 1:
-    try:
-        camera = cv2.VideoCapture(0)
-        camera_status = True
-    except:
-        camera_status = False
-    
-    from robot import trackerFollower_webcam as trackerFollower
-else:
+if camera_type not in (0, 1):
     raise ValueError("Invalid camera type.")
 
+def createFrameSource():
+    ''' CREATE CAMERA FRAME SOURCE BASED ON CAMERA TYPE
+
+    Returns:
+            [frame_source, camera_status] : (arr) Frame source (None if camera is unavailable) and camera status.
+    '''
+
+    if camera_type == 0:
+        try:
+            from picamera import PiCamera
+            camera = PiCamera()
+            camera.resolution = (camera_resolution[0], camera_resolution[1])
+        except:
+            return [None, False]
+
+        from capture import PiCameraFrameSource as FrameSource
+    elif camera_type == 1:
+        try:
+            camera = cv2.VideoCapture(0)
+        except:
+            return [None, False]
+        
+        from capture import WebcamFrameSource as FrameSource
+
+    return [FrameSource(camera, camera_resolution, gray=True), True]
+
 # image params
-if camera_status and camera_type == 0:
-    center_image_x = camera.resolution[0] / 2
-    center_image_y = camera.resolution[1] / 2
+center_image_x = camera_resolution[0] / 2
+center_image_y = camera_resolution[1] / 2
+
+# tracker
+tracker_process = False # Tracker thread: False | Tracker process: True
 
 ## bounding constants
 #min_area = 300
@@ -71,6 +91,19 @@ if camera_status and camera_type == 0:
 #### Main
 if __name__ == '__main__':
     global_params.init()
+
+    # camera and robot are opened by worker process when tracker runs there
+    if tracker_process:
+        tracker = TrackerProcess(createFrameSource, createRobot, camera_resolution)
+        camera_status = tracker.start()
+        [camera, robot] = [None, None]
+        trackerFollower = tracker.trackerFollower
+        global_params.tracker_state = tracker.state
+    else:
+        [camera, camera_status] = createFrameSource()
+        robot = createRobot()
+        global_params.tracker_state = TrackerState()
+
     if camera_status:
         global_params.camera = camera
         global_params.camera_resolution = camera_resolution
@@ -80,8 +113,8 @@ if __name__ == '__main__':
         GPIO.output(20, GPIO.HIGH)
         robot_status = True
 
-    if len(glob('datafile.csv')) > 0:
-        remove('datafile.csv')
+    for datafile in glob('datafile.csv') + glob(path.join('datafile', '*.col')):
+        remove(datafile)
 
     try:
         serial_port_1 = Serial('/dev/rfcomm0', 115200, timeout=.1)
@@ -104,30 +137,19 @@ if __name__ == '__main__':
     global_params.imu2_status = imu2_status
     global_params.robot = robot
     global_params.trackerFollower = trackerFollower
-    global_params.recordStream = recordStream
     
     root = tk.Tk()
 #    root.geometry('480x320')
     root.attributes('-fullscreen', True)
     appGUI = appGUI(root)
     
-    run = True
     def update_run():
-        global run
-        run = False
+        global_params.metronome.close()
+        global_params.audio_dispatcher.close()
+        if tracker_process:
+            tracker.close()
         root.destroy()
     root.protocol("WM_DELETE_WINDOW", update_run)
     
-    while(run):
-        root.update()
-
-        ## metronome
-        prev = time.perf_counter()
-        delay = 60.0 / global_params.bpm
-        if global_params.play_button_state:
-            time.sleep(delay)
-            curr = time.perf_counter()
-            delta = curr - prev - delay
-            delay -= delta
-
-            global_params.mixer.Sound(global_params.tick).play()
+    ## event-driven; metronome, tracker and recorder run on their own threads
+    root.mainloop()
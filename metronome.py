@@ -0,0 +1,146 @@
+'''
+__author       = "Chen Si-En, Sarah"
+__copyright    = "Copyright 2021, Chen Si-En, Sarah"
+
+__description  = "Metronome service for Rehabot 2.0"
+__version      = "1.2.0"
+__status       = "Production"
+__dependencies = "numpy, pygame"
+'''
+
+import threading
+import numpy as np
+from collections import deque
+from time import perf_counter
+
+class Metronome(object):
+    ''' DRIFT-FREE METRONOME ON ITS OWN THREAD
+            Beats are scheduled on an absolute timeline, start + k * period, read from the
+            monotonic perf_counter clock, so sleep overshoot never accumulates. The thread
+            sleeps until shortly before each beat and spins for the rest, and plays a
+            click decoded once on a channel reserved for it. The scheduled and actual
+            emission time of every beat is logged to measure jitter. An idle metronome
+            costs no CPU.
+    Args:
+            channel     : (Channel,      required) Mixer channel reserved for the metronome.
+            tick        : (Sound,        required) Decoded tick sound.
+            bpm         : (int,          optional) Beats per minute. Defaults to 80.
+            spin_time   : (float,        optional) Seconds before a beat to stop sleeping and spin. Defaults to 0.002.
+            log_length  : (int,          optional) Number of beats kept in the log. Defaults to 1000.
+    '''
+
+    def __init__(self, channel, tick, bpm=80, spin_time=0.002, log_length=1000):
+        self.bpm = bpm
+        self.spin_time = spin_time
+
+        # preloaded click on reserved channel
+        self.sound = tick
+        self.channel = channel
+
+        # beat log of (scheduled time, emission time)
+        self.beats = deque(maxlen=log_length)
+        self.skipped = 0
+
+        self.playing = False
+        self.running = True
+        self.wake = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def setBpm(self, bpm):
+        ''' SET BEATS PER MINUTE; TIMELINE RESTARTS FROM LAST BEAT
+        Args:
+                bpm  : (int, required) Beats per minute.
+        '''
+
+        self.bpm = bpm
+        self.wake.set()
+
+    def start(self):
+        ''' START PLAYING; FIRST TICK AFTER ONE BEAT
+
+        '''
+
+        self.beats.clear()
+        self.skipped = 0
+        self.playing = True
+        self.wake.set()
+
+    def stop(self):
+        ''' STOP PLAYING
+
+        '''
+
+        self.playing = False
+        self.wake.set()
+
+    def run(self):
+        ''' METRONOME LOOP; RUNS ON BACKGROUND THREAD
+
+        '''
+
+        while self.running:
+            if not self.playing:
+                self.wake.wait()
+                self.wake.clear()
+                continue
+
+            ## new timeline from now, or from last beat on a BPM change
+            start = perf_counter()
+            if len(self.beats) > 0 and start - self.beats[-1][0] < 60.0 / self.bpm:
+                start = self.beats[-1][0]
+            period = 60.0 / self.bpm
+            k = 1
+
+            while self.running and self.playing:
+                beat = start + k * period
+
+                # sleep until just before beat; a start/stop/BPM change restarts the timeline
+                if self.wake.wait(max(0.0, beat - perf_counter() - self.spin_time)):
+                    self.wake.clear()
+                    break
+                # spin holding the GIL; sleep(0) would let other threads run past the beat
+                while perf_counter() < beat:
+                    pass
+
+                self.channel.play(self.sound)
+                self.beats.append((beat, perf_counter()))
+
+                # after a stall, skip missed beats instead of playing them in a burst
+                k += 1
+                missed = int((perf_counter() - start) / period) - k + 1
+                if missed > 0:
+                    self.skipped += missed
+                    k += missed
+
+    def getJitter(self):
+        ''' GET MEASURED BEAT TIMING ERROR
+
+        Returns:
+                jitter  : (dict) Number of beats logged and skipped, and mean, standard
+                          deviation and largest emission error in ms.
+        '''
+
+        beats = np.array(self.beats)
+        if len(beats) == 0:
+            return {"beats" : 0, "skipped" : self.skipped, "mean_ms" : None, "std_ms" : None, "max_ms" : None}
+
+        error = (beats[:,1] - beats[:,0]) * 1000
+
+        return {
+            "beats" : len(beats),
+            "skipped" : self.skipped,
+            "mean_ms" : np.mean(error),
+            "std_ms" : np.std(error),
+            "max_ms" : np.max(np.abs(error)),
+        }
+
+    def close(self):
+        ''' STOP BACKGROUND THREAD
+
+        '''
+
+        self.running = False
+        self.playing = False
+        self.wake.set()
+        self.thread.join()
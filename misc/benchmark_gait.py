@@ -0,0 +1,112 @@
+'''
+__author       = "Chen Si-En, Sarah"
+__copyright    = "Copyright 2021, Chen Si-En, Sarah"
+
+__description  = "Benchmark of camera stride segmentation on synthetic sessions"
+__version      = "1.2.0"
+__status       = "Production"
+__dependencies = "numpy, pandas, gait.py"
+'''
+
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from gait import segmentCameraRuns
+
+def synthCameraSession(minutes, fps=15, seed=0):
+    ''' SYNTHETIC CAMERA ROWS; ROBOT MOVES FOR 2.5 s OF EVERY 4 s STRIDE WITH NOISY STATES
+    Args:
+            minutes   : (float, required) Session length.
+            fps       : (int,   optional) Camera rows per second. Defaults to 15.
+            seed      : (int,   optional) Random seed. Defaults to 0.
+
+    Returns:
+            cam_data  : (DataFrame) Columns [time, camera state] as in getCadenceStrideTime.
+    '''
+
+    rng = np.random.default_rng(seed)
+    t = np.arange(3.0, 3.0 + minutes*60, 1/fps) + rng.normal(0, 0.005, int(round(minutes*60*fps)))
+    state = ((t % 4) < 2.5).astype(int)
+
+    # marker lost for a frame now and then
+    flips = rng.integers(0, len(state), len(state) // 200)
+    state[flips] ^= 1
+
+    return pd.DataFrame({0: 1.7e9 + t, 1: state})
+
+def loopCameraRuns(cam_data, thres=3):
+    ''' ROW-BY-ROW CAMERA SEGMENTATION REPLACED BY segmentCameraRuns
+    Args:
+            cam_data  : (DataFrame, required) Columns [time, camera state].
+            thres     : (int,       optional) Minimum rows in a run. Defaults to 3.
+
+    Returns:
+            cam_cadence, cam_stride_time
+    '''
+
+    tmp = []
+    prev = None
+    curr = None
+
+    for i in range(0, len(cam_data)-1):
+        if cam_data.iloc[i,1] == 0 and cam_data.iloc[i+1,1] == 1:
+            prev = i
+            prev_time = cam_data.iloc[i+1,0]
+
+        if cam_data.iloc[i,1] == 1 and cam_data.iloc[i+1,1] == 0:
+            curr = i
+            curr_time = cam_data.iloc[i+1,0]
+
+        if prev != None and curr != None:
+            tmp.append([curr-prev, curr_time])
+            prev = None
+            curr = None
+    tmp = np.array(tmp)
+    tmp = tmp[tmp[:,0] >= thres]
+    tmp = np.array(sorted(tmp, key=lambda x:x[1]))
+
+    cam_stride_time = []
+    if len(tmp) > 1:
+        for i in range(0, len(tmp)-1):
+            cam_stride_time.append(tmp[i+1,1]-tmp[i,1])
+        cam_stride_time = np.mean(cam_stride_time)
+    else:
+        cam_stride_time = None
+
+    return len(tmp), cam_stride_time
+
+def timeit(func, repeat):
+    ''' BEST OF repeat RUNS
+    Args:
+            func    : (function, required) Function to time.
+            repeat  : (int,      required) Number of runs.
+
+    Returns:
+            best    : (float) Shortest run time in seconds.
+            res     : Result of last run.
+    '''
+
+    best = np.inf
+    for i in range(0, repeat):
+        start_time = time.perf_counter()
+        res = func()
+        best = min(best, time.perf_counter() - start_time)
+
+    return best, res
+
+if __name__ == '__main__':
+    print('%8s %8s %12s %12s %9s  %s' % ('minutes', 'rows', 'loop (s)', 'vector (s)', 'speedup', 'results'))
+
+    for minutes in [1, 10, 60]:
+        cam_data = synthCameraSession(minutes)
+
+        loop_time, loop_res = timeit(lambda: loopCameraRuns(cam_data), 1)
+        vector_time, vector_res = timeit(lambda: segmentCameraRuns(cam_data[1].to_numpy(), cam_data[0].to_numpy())[:2], 5)
+
+        same = loop_res[0] == vector_res[0] and np.isclose(loop_res[1], vector_res[1])
+        print('%8d %8d %12.4f %12.6f %8.0fx  %s' % (minutes, len(cam_data), loop_time, vector_time, \
+                                                   loop_time / vector_time, 'same' if same else 'DIFFERENT'))
@@ -0,0 +1,166 @@
+'''
+__author       = "Chen Si-En, Sarah"
+__copyright    = "Copyright 2021, Chen Si-En, Sarah"
+
+__description  = "Motor controller with command coalescing, speed ramps and safety watchdog"
+__version      = "1.2.0"
+__status       = "Production"
+__dependencies = "gpiozero"
+'''
+
+import threading
+from time import perf_counter, sleep
+
+class MotorController(object):
+    ''' MOTOR CONTROLLER OVER GPIOZERO ROBOT
+            Drop-in for the Robot's forward/backward/stop. A GPIO write is only made when
+            the commanded velocity changes. With a ramp_time, speed changes are ramped
+            through PWM instead of stepped; stopping is always immediate. A watchdog stops
+            the motors when no command arrives within watchdog_timeout seconds, e.g. if the
+            tracker loop stalls.
+    Args:
+            robot             : (robot obj, required) GPIO robot created in main.py
+            speed             : (float,     optional) Default speed, 0 to 1. Defaults to 1.0.
+            ramp_time         : (float,     optional) Seconds to ramp from stop to full speed. Defaults to 0.0 (off).
+            watchdog_timeout  : (float,     optional) Seconds without a command before stopping. Defaults to 0.5.
+            period            : (float,     optional) Seconds between ramp steps and watchdog checks. Defaults to 0.02.
+    '''
+
+    def __init__(self, robot, speed=1.0, ramp_time=0.0, watchdog_timeout=0.5, period=0.02):
+        self.robot = robot
+        self.speed = speed
+        self.ramp_time = ramp_time
+        self.watchdog_timeout = watchdog_timeout
+        self.period = period
+
+        # signed velocity; forward > 0 > backward
+        self.target = 0.0
+        self.output = 0.0
+        self.last_command_time = perf_counter()
+        self.lock = threading.Lock()
+
+        # counters
+        self.start_time = perf_counter()
+        self.commands_received = 0
+        self.commands_sent = 0
+        self.commands_coalesced = 0
+        self.watchdog_stops = 0
+
+        # ramp and watchdog thread
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def forward(self, speed=None):
+        ''' MOVE FORWARD
+        Args:
+                speed  : (float, optional) Speed, 0 to 1. Defaults to controller speed.
+        '''
+
+        self.command(self.speed if speed is None else speed)
+
+    def backward(self, speed=None):
+        ''' MOVE BACKWARD
+        Args:
+                speed  : (float, optional) Speed, 0 to 1. Defaults to controller speed.
+        '''
+
+        self.command(-(self.speed if speed is None else speed))
+
+    def stop(self):
+        ''' STOP IMMEDIATELY
+
+        '''
+
+        self.command(0.0)
+
+    def command(self, velocity):
+        ''' SET TARGET VELOCITY; WRITES GPIO ONLY WHEN IT CHANGES
+        Args:
+                velocity  : (float, required) Signed velocity, -1 (full backward) to 1 (full forward).
+        '''
+
+        with self.lock:
+            self.commands_received += 1
+            self.last_command_time = perf_counter()
+
+            if velocity == self.target:
+                self.commands_coalesced += 1
+                return
+            self.target = velocity
+
+            # ramped changes are written by the ramp thread
+            if self.ramp_time > 0 and velocity != 0.0:
+                return
+            self.write(velocity)
+
+    def write(self, velocity):
+        ''' WRITE VELOCITY TO GPIO; CALLED WITH LOCK HELD
+        Args:
+                velocity  : (float, required) Signed velocity.
+        '''
+
+        if velocity > 0:
+            self.robot.forward(velocity)
+        elif velocity < 0:
+            self.robot.backward(-velocity)
+        else:
+            self.robot.stop()
+        self.output = velocity
+        self.commands_sent += 1
+
+    def run(self):
+        ''' RAMP AND WATCHDOG LOOP; RUNS ON BACKGROUND THREAD
+
+        '''
+
+        while self.running:
+            sleep(self.period)
+
+            with self.lock:
+                # watchdog
+                if self.target != 0.0 and perf_counter() - self.last_command_time > self.watchdog_timeout:
+                    self.target = 0.0
+                    self.write(0.0)
+                    self.watchdog_stops += 1
+                    continue
+
+                # ramp output towards target
+                if self.output != self.target:
+                    step = self.period / self.ramp_time if self.ramp_time > 0 else abs(self.target - self.output)
+                    if abs(self.target - self.output) <= step:
+                        self.write(self.target)
+                    elif self.target > self.output:
+                        self.write(round(self.output + step, 6))
+                    else:
+                        self.write(round(self.output - step, 6))
+
+    def getCounters(self):
+        ''' GET COMMAND COUNTERS
+
+        Returns:
+                counters  : (dict) Commands received, GPIO writes made, commands coalesced and
+                            watchdog stops, and received and written commands per second.
+        '''
+
+        elapsed_time = max(perf_counter() - self.start_time, 1e-6)
+
+        return {
+            "commands_received" : self.commands_received,
+            "commands_sent" : self.commands_sent,
+            "commands_coalesced" : self.commands_coalesced,
+            "watchdog_stops" : self.watchdog_stops,
+            "received_per_s" : self.commands_received / elapsed_time,
+            "sent_per_s" : self.commands_sent / elapsed_time,
+        }
+
+    def close(self):
+        ''' STOP MOTORS AND BACKGROUND THREAD
+
+        '''
+
+        self.running = False
+        self.thread.join()
+        with self.lock:
+            self.target = 0.0
+            self.write(0.0)
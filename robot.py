@@ -5,15 +5,17 @@ __copyright    = "Copyright 2021, Chen Si-En, Sarah"
 __description  = "Functions for wheeled robot ArUco marker follower with timed audio cues"
 __version      = "1.2.0"
 __status       = "Production"
-__dependencies = "cv2, numpy, global_params.py"
+__dependencies = "cv2, numpy, global_params.py, audio.py, scheduler.py"
 '''
 
+import threading
 import cv2
 import cv2.aruco as aruco
 import numpy as np
-from time import time
-from random import randint
+from time import perf_counter
 import global_params
+from audio import CUE, ENCOURAGEMENT
+from scheduler import DeadlineScheduler
 
 def loadMtx(path):
     ''' GETS CALIBRATION MATRIX FROM .TXT FILE GENERATED FROM CV2 CALIBRATION
@@ -34,134 +36,584 @@ def loadMtx(path):
 # get calib mtx
 [mtx, dist] = loadMtx('calib.txt')
 
-def trackerFollower_picamera(camera, camera_resolution, robot, cue, encouragement, stop_trackerFollower, sensitivity):
-    ''' FUNCTION TO TRACK ARUCO MARKERS AND ACTIVATE GPIO ROBOT MOVEMENT 
+# motor commands
+STOP = 0
+FORWARD = 1
+BACKWARD = 2
+
+# coasting after marker loss was counted in frames (sensitivity*10) at about this rate
+COAST_REFERENCE_FPS = 20.0
+
+# tracker states
+IDLE = 0
+ACQUIRING = 1
+TRACKING = 2
+
+class MarkerDetector(object):
+    ''' REUSABLE ARUCO MARKER DETECTOR
+            Built once per session; owns the ArUco dictionary, detector parameters and
+            camera calibration so that none of it is rebuilt on every frame.
+
+            In tracking mode, only a padded window around the corners found in the last
+            frame is searched. The window is widened step by step while the marker is
+            lost, and a full-frame search is done after roi_max_misses misses.
+
+            With scale < 1, markers are first detected on a downscaled copy of the frame
+            and their corners refined on the full-resolution image; the search is
+            repeated at full resolution when the downscaled copy finds nothing.
+
+            With a change_threshold, a tiny downsampled signature of each frame is compared
+            with that of the last frame actually searched; when no signature cell changed
+            by the threshold the last result is reused. The largest cell change is used,
+            not the mean, so a marker turning or flipping is never averaged away by the
+            rest of the scene. A search is forced at least every
+            redetect_interval frames so a stale result is never kept for long.
     Args:
-            camera                : (camera obj,   required) Either Pi camera or webcam object based on setting in main.py
-            camera_resolution     : (arr of 2 int, required) Camera resolution in pixels
-            robot                 : (robot obj,    required) GPIO robot created in main.py
-            cue                   : (arr,          required) List of audio cue files available.
-            encouragement         : (arr,          required) List of audio encouragment files available.
-            stop_trackerFollower  : (bool,         required) Whether to stop camera tracking and robot
-            sensitivity           : (int,          required) Sensitivity setting of robot
+            mtx             : (arr,   required) Camera matrix from calibration file.
+            dist            : (arr,   required) Distortion coefficients from calibration file.
+            dictionary      : (int,   optional) ArUco predefined dictionary. Defaults to DICT_5X5_250.
+            marker_length   : (float, optional) Marker side length in metres. Defaults to 0.05.
+            tracking        : (bool,  optional) Search around last detected corners. Defaults to False.
+            roi_padding     : (float, optional) Window padding as a fraction of marker size. Defaults to 0.5.
+            roi_min_padding : (int,   optional) Minimum window padding in pixels. Defaults to 16.
+            roi_growth      : (float, optional) Padding growth factor on each miss. Defaults to 2.0.
+            roi_max_misses  : (int,   optional) Misses before reverting to full-frame search. Defaults to 3.
+            scale           : (float, optional) Downscale factor of coarse detection pass. Defaults to 1.0 (off).
+            change_threshold  : (float, optional) Largest gray-level change of a signature cell below
+                                which frames are skipped.
+                                Defaults to None (off).
+            redetect_interval : (int,   optional) Maximum number of frames skipped in a row. Defaults to 10.
     '''
-    
-    # audio flags
-    cue_play_flag = 0
-    encouragement_play_flag = 0
 
-    # timing
-    stop_flag = 1
-    robotStop_start_time = time() # start counting time when robot is stopped
+    def __init__(self, mtx, dist, dictionary=aruco.DICT_5X5_250, marker_length=0.05, \
+                 tracking=False, roi_padding=0.5, roi_min_padding=16, roi_growth=2.0, roi_max_misses=3, \
+                 scale=1.0, change_threshold=None, redetect_interval=10):
+        # calibration converted once to the layout cv2 expects
+        self.mtx = np.ascontiguousarray(mtx, dtype=np.float64)
+        self.dist = np.ascontiguousarray(dist, dtype=np.float64).reshape(1, -1)
+        self.marker_length = marker_length
+
+        # last detection, replaced under a lock so readers on other threads get corners
+        # and ids of one frame; pose is only estimated when asked for, and kept with the
+        # corners it was estimated from
+        self.lock = threading.Lock()
+        self.corners = ()
+        self.ids = None
+        self.frame_shape = None
+        self.pose = None
+
+        # undistorted position of every pixel, built on first pose estimate
+        self.undistort_map = None
+        self.no_dist = np.zeros((1, 5))
 
-    # main
-    from picamera.array import PiRGBArray
-    rawCapture = PiRGBArray(camera, size=(camera_resolution[0], camera_resolution[1]))
+        # get aruco dict
+        self.aruco_dict = aruco.Dictionary_get(dictionary)
 
-    SENSITIVITY = sensitivity * 10
-    spd = 0 
-    prev_robot_direction = None
+        # detector parameters
+        self.parameters = aruco.DetectorParameters_create()
+        self.parameters.adaptiveThreshConstant = 10
+        self.min_perimeter_rate = self.parameters.minMarkerPerimeterRate
+        self.max_perimeter_rate = self.parameters.maxMarkerPerimeterRate
+
+        # tracking mode
+        self.tracking = tracking
+        self.roi_padding = roi_padding
+        self.roi_min_padding = roi_min_padding
+        self.roi_growth = roi_growth
+        self.roi_max_misses = roi_max_misses
+        self.reset()
+
+        # coarse-to-fine mode
+        self.scale = scale
+        self.refine_win = (int(round(1/scale)) + 1, int(round(1/scale)) + 1)
+        self.refine_criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 0.01)
+
+        # change detection
+        self.change_threshold = change_threshold
+        self.redetect_interval = redetect_interval
+        self.signature_size = (32, 24)
+        self.signature = None
+        self.frames_skipped = 0
+
+        # per-call timings (seconds)
+        self.num_calls = 0
+        self.num_roi_calls = 0
+        self.num_coarse_misses = 0
+        self.num_skipped = 0
+        self.last_time = 0.0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def reset(self):
+        ''' FORGET LAST DETECTED MARKER; NEXT SEARCH IS FULL-FRAME
+            
+        '''
+
+        self.last_bbox = None
+        self.roi_misses = 0
+
+    def detect(self, gray):
+        ''' DETECT ARUCO MARKERS IN GRAYSCALE FRAME
+        Args:
+                gray  : (arr, required) Grayscale camera frame.
+
+        Returns:
+                corners, ids : (arr) Marker corners and ids (None when no marker is detected).
+        '''
+
+        start_time = perf_counter()
+
+        # reuse last result when frame has barely changed, unless tracking window is still widening
+        if self.change_threshold is not None and self.roi_misses == 0 and not self.hasChanged(gray):
+            self.num_skipped += 1
+            return self.corners, self.ids
 
-    for capture in camera.capture_continuous(rawCapture, format="bgr", use_video_port=True):
-        # read each frame from camera
-        frame = capture.array
+        # detect aruco markers
+        roi = self.getROI(gray.shape)
+        if roi is None:
+            corners, ids = self.detectRegion(gray, 0, 0)
+        else:
+            [x0, y0, x1, y1] = roi
+            corners, ids = self.detectRegion(gray[y0:y1, x0:x1], x0, y0, max(gray.shape))
+            self.num_roi_calls += 1
+
+        if self.tracking:
+            self.updateROI(corners, ids)
+
+        with self.lock:
+            self.corners = corners
+            self.ids = ids
+            self.frame_shape = gray.shape[:2]
+
+        elapsed_time = perf_counter() - start_time
+        self.num_calls += 1
+        self.last_time = elapsed_time
+        self.total_time += elapsed_time
+        self.max_time = max(self.max_time, elapsed_time)
+
+        return corners, ids
+
+    def getUndistortMap(self, shape):
+        ''' GET UNDISTORTED POSITION OF EVERY PIXEL; COMPUTED ONCE PER FRAME SIZE
+        Args:
+                shape  : (arr of 2 int, required) Frame height and width.
+
+        Returns:
+                map_x, map_y : (arr) Undistorted column and row of each pixel.
+        '''
+
+        if self.undistort_map is None or self.undistort_map[0].shape != tuple(shape):
+            ys, xs = np.mgrid[0:shape[0], 0:shape[1]].astype(np.float32)
+            points = cv2.undistortPoints(np.stack([xs, ys], -1).reshape(-1, 1, 2), self.mtx, self.dist, P=self.mtx)
+            points = points.reshape(shape[0], shape[1], 2)
+            self.undistort_map = [np.ascontiguousarray(points[:,:,0]), np.ascontiguousarray(points[:,:,1])]
+
+        return self.undistort_map
+
+    def getPose(self):
+        ''' GET POSE OF EACH MARKER IN LAST DETECTION
+                Estimated on first call after each detection, for all markers in one call.
+                Corners are undistorted by interpolating the precomputed undistortion map,
+                so the pose is solved without distortion model.
+
+        Returns:
+                rvec, tvec : (arr) Rotation and translation vector of each marker (None when
+                             no marker is detected).
+        '''
+
+        # corners and ids of one detection
+        with self.lock:
+            [corners, ids, shape] = [self.corners, self.ids, self.frame_shape]
+            if ids is None:
+                return None, None
+            if self.pose is not None and self.pose[0] is corners:
+                return self.pose[1], self.pose[2]
+
+        [map_x, map_y] = self.getUndistortMap(shape)
+        points = np.concatenate(corners).reshape(-1, 1, 2).astype(np.float32)
+        undistorted = np.stack([cv2.remap(map_x, points[:,:,0], points[:,:,1], cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE), \
+                                cv2.remap(map_y, points[:,:,0], points[:,:,1], cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)], -1)
+
+        # estimate pose of each marker and return the values rvet and tvec-different from camera coefficients
+        rvec, tvec, _ = aruco.estimatePoseSingleMarkers(list(undistorted.reshape(-1, 1, 4, 2)), self.marker_length, \
+                                                        self.mtx, self.no_dist)
+
+        with self.lock:
+            if self.corners is corners:
+                self.pose = [corners, rvec, tvec]
+
+        return rvec, tvec
+
+    def getDistance(self):
+        ''' GET DISTANCE FROM CAMERA TO EACH MARKER IN LAST DETECTION
+
+        Returns:
+                distance  : (arr) Distance of each marker in metres (None when no marker is detected).
+        '''
+
+        rvec, tvec = self.getPose()
+        if tvec is None:
+            return None
+
+        return np.linalg.norm(tvec.reshape(-1, 3), axis=1)
+
+    def hasChanged(self, gray):
+        ''' CHECK IF FRAME DIFFERS FROM LAST SEARCHED FRAME
+        Args:
+                gray     : (arr, required) Grayscale camera frame.
+
+        Returns:
+                changed  : (bool) Whether the frame should be searched.
+        '''
+
+        signature = cv2.resize(gray, self.signature_size, interpolation=cv2.INTER_AREA)
+
+        if self.signature is not None and self.frames_skipped < self.redetect_interval:
+            if cv2.absdiff(signature, self.signature).max() < self.change_threshold:
+                self.frames_skipped += 1
+                return False
+
+        self.signature = signature
+        self.frames_skipped = 0
+        return True
+
+    def detectRegion(self, gray, x_offset, y_offset, full_size=None):
+        ''' DETECT ARUCO MARKERS IN (PART OF) GRAYSCALE FRAME
+        Args:
+                gray      : (arr, required) Grayscale frame or window cut from it.
+                x_offset  : (int, required) Column of window in full frame.
+                y_offset  : (int, required) Row of window in full frame.
+                full_size : (int, optional) Largest dimension of full frame when gray is a window.
+
+        Returns:
+                corners, ids : (arr) Marker corners in full-frame coordinates and marker ids.
+        '''
+
+        # perimeter limits are relative to image size; keep them relative to the full frame
+        if full_size is not None:
+            ratio = full_size / max(gray.shape)
+            self.parameters.minMarkerPerimeterRate = self.min_perimeter_rate * ratio
+            self.parameters.maxMarkerPerimeterRate = self.max_perimeter_rate * ratio
+        else:
+            self.parameters.minMarkerPerimeterRate = self.min_perimeter_rate
+            self.parameters.maxMarkerPerimeterRate = self.max_perimeter_rate
+
+        if self.scale < 1.0:
+            corners, ids = self.detectCoarse(gray)
+            if ids is None:
+                self.num_coarse_misses += 1
+                corners, ids, rejectedImgPoints = aruco.detectMarkers(gray, self.aruco_dict, parameters=self.parameters)
+        else:
+            corners, ids, rejectedImgPoints = aruco.detectMarkers(gray, self.aruco_dict, parameters=self.parameters)
+
+        if ids is not None and (x_offset or y_offset):
+            offset = np.array([x_offset, y_offset], dtype=np.float32)
+            corners = tuple(c + offset for c in corners)
+
+        return corners, ids
+
+    def detectCoarse(self, gray):
+        ''' DETECT ARUCO MARKERS ON DOWNSCALED FRAME, REFINE CORNERS ON FULL FRAME
+        Args:
+                gray  : (arr, required) Grayscale frame or window cut from it.
+
+        Returns:
+                corners, ids : (arr) Refined marker corners and marker ids.
+        '''
+
+        small = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        corners, ids, rejectedImgPoints = aruco.detectMarkers(small, self.aruco_dict, parameters=self.parameters)
+        if ids is None:
+            return corners, ids
+
+        # map corners back to full resolution and refine them there
+        pts = (np.concatenate([c.reshape(-1, 2) for c in corners]) + 0.5) / self.scale - 0.5
+        pts = np.ascontiguousarray(pts, dtype=np.float32)
+        cv2.cornerSubPix(gray, pts, self.refine_win, (-1, -1), self.refine_criteria)
+        corners = tuple(pts[4*i:4*i+4].reshape(1, 4, 2) for i in range(len(corners)))
+
+        return corners, ids
+
+    def getROI(self, shape):
+        ''' GET SEARCH WINDOW AROUND LAST DETECTED CORNERS
+        Args:
+                shape  : (tuple, required) Shape of grayscale frame.
+
+        Returns:
+                roi    : (arr of 4 int) [x0, y0, x1, y1] window, or None for full-frame search.
+        '''
+
+        if not self.tracking or self.last_bbox is None or self.roi_misses > self.roi_max_misses:
+            return None
+
+        [x0, y0, x1, y1] = self.last_bbox
+        size = max(x1 - x0, y1 - y0)
+        pad = max(self.roi_min_padding, self.roi_padding * size) * (self.roi_growth ** self.roi_misses)
+
+        x0 = max(0, int(x0 - pad))
+        y0 = max(0, int(y0 - pad))
+        x1 = min(shape[1], int(x1 + pad) + 1)
+        y1 = min(shape[0], int(y1 + pad) + 1)
+
+        # window covers (almost) whole frame; cheaper to search it directly
+        if (x1 - x0) * (y1 - y0) >= 0.75 * shape[0] * shape[1]:
+            return None
+
+        return [x0, y0, x1, y1]
+
+    def centerROI(self, x, y):
+        ''' MOVE TRACKING WINDOW TO PREDICTED MARKER CENTRE
+        Args:
+                x  : (float, required) Predicted marker centre column.
+                y  : (float, required) Predicted marker centre row.
+        '''
+
+        if self.last_bbox is None:
+            return
+
+        [x0, y0, x1, y1] = self.last_bbox
+        dx = x - (x0 + x1)/2
+        dy = y - (y0 + y1)/2
+        self.last_bbox = [x0 + dx, y0 + dy, x1 + dx, y1 + dy]
+
+    def updateROI(self, corners, ids):
+        ''' UPDATE TRACKING WINDOW FROM DETECTION RESULT
+        Args:
+                corners  : (arr, required) Detected marker corners.
+                ids      : (arr, required) Detected marker ids.
+        '''
+
+        if ids is not None:
+            pts = np.concatenate([c.reshape(-1, 2) for c in corners])
+            self.last_bbox = [pts[:,0].min(), pts[:,1].min(), pts[:,0].max(), pts[:,1].max()]
+            self.roi_misses = 0
+        elif self.last_bbox is not None:
+            self.roi_misses += 1
+            if self.roi_misses > self.roi_max_misses:
+                self.reset()
+
+    def getTimings(self):
+        ''' GET PER-CALL DETECTION TIMINGS
+
+        Returns:
+                timings  : (dict) Number of searched and skipped frames, window searches and
+                           coarse-pass misses, and last, mean and max detection time in ms.
+        '''
+
+        return {
+            "num_calls" : self.num_calls,
+            "num_skipped" : self.num_skipped,
+            "num_roi_calls" : self.num_roi_calls,
+            "num_coarse_misses" : self.num_coarse_misses,
+            "last_ms" : 1000*self.last_time,
+            "mean_ms" : 1000*self.total_time / self.num_calls if self.num_calls else 0.0,
+            "max_ms" : 1000*self.max_time,
+        }
+
+class FrameRateGovernor(object):
+    ''' STATE-AWARE TRACKER FRAME RATE
+            Sets the frame rate of the frame source for each state: tracking (robot moving),
+            acquiring (robot stopped, marker lost recently) and idle (robot stopped for
+            longer than idle_after). Frames in between are dropped on the capture thread
+            before conversion, so neither capture nor detection pays for them. While the
+            robot is stopped, a frame whose scene changed by wake_threshold in any cell of
+            its signature is published at once, so a marker coming back into view is seen
+            as fast as at full rate.
+            The tracking rate applies from the first frame the robot moves again.
+    Args:
+            frame_source    : (FrameSource, required) Frame source read by the tracker.
+            rates           : (dict,        optional) Target frames per second of each state; None for no limit.
+            idle_after      : (float,       optional) Seconds stopped before going idle. Defaults to 3.0.
+            wake_threshold  : (float,       optional) Largest gray-level change of a signature cell
+                              publishing a frame early. Defaults to 12.0.
+    '''
 
-        if global_params.stop_trackerFollower:
-            break
+    def __init__(self, frame_source, rates=None, idle_after=3.0, wake_threshold=12.0):
+        self.frame_source = frame_source
+        self.rates = {IDLE: 10, ACQUIRING: 20, TRACKING: None}
+        if rates is not None:
+            self.rates.update(rates)
+        self.idle_after = idle_after
+        self.wake_threshold = wake_threshold
+
+        self.state = None
+        self.stop_time = perf_counter()
+        self.state_frames = {IDLE: 0, ACQUIRING: 0, TRACKING: 0}
+        self.setState(ACQUIRING)
+
+    def setState(self, state):
+        ''' SET FRAME RATE OF FRAME SOURCE WHEN STATE CHANGES
+        Args:
+                state  : (int, required) IDLE, ACQUIRING or TRACKING.
+        '''
+
+        if state == self.state:
+            return
+        self.state = state
+
+        self.frame_source.setFrameRate(self.rates[state], None if state == TRACKING else self.wake_threshold)
+
+    def update(self, moving):
+        ''' UPDATE STATE FROM LATEST ROBOT MOVEMENT
+        Args:
+                moving  : (bool, required) Whether the robot is moving (marker seen or coasting).
+
+        Returns:
+                state   : (int) IDLE, ACQUIRING or TRACKING.
+        '''
+
+        now = perf_counter()
+        if moving:
+            self.setState(TRACKING)
+            self.stop_time = now
+        elif now - self.stop_time > self.idle_after:
+            self.setState(IDLE)
+        else:
+            self.setState(ACQUIRING)
+        self.state_frames[self.state] += 1
+
+        return self.state
+
+class MarkerPredictor(object):
+    ''' CONSTANT-VELOCITY (ALPHA-BETA) PREDICTOR OF MARKER POSITION
+            Tracks the marker centre and its velocity from timed detections. After the
+            marker is lost its position is extrapolated for coast_time seconds, after which
+            there is no prediction and the robot stops, whatever the frame rate.
+    Args:
+            coast_time  : (float, required) Seconds to coast after the last detection.
+            alpha       : (float, optional) Position gain. Defaults to 0.85.
+            beta        : (float, optional) Velocity gain. Defaults to 0.3.
+    '''
 
-        if (cue_play_flag == 1):
-            cue_play_flag = 0
-            robotStop_start_time = time() # reset robotStop_start_time to 0
+    def __init__(self, coast_time, alpha=0.85, beta=0.3):
+        self.coast_time = coast_time
+        self.alpha = alpha
+        self.beta = beta
+        self.position = None
+        self.velocity = np.zeros(2)
+        self.last_time = None
+
+    def update(self, position, t):
+        ''' UPDATE TRACK WITH DETECTED MARKER CENTRE
+        Args:
+                position  : (arr of 2 float, required) Detected marker centre in pixels.
+                t         : (float,          required) Time of detection in seconds.
+        '''
+
+        position = np.asarray(position, dtype=np.float64)
+        if self.position is None:
+            self.position = position
+            self.velocity = np.zeros(2)
+        else:
+            dt = t - self.last_time
+            if dt > 1e-3:
+                predicted = self.position + self.velocity*dt
+                residual = position - predicted
+                self.position = predicted + self.alpha*residual
+                self.velocity = self.velocity + self.beta*residual/dt
+        self.last_time = t
+
+    def predict(self, t):
+        ''' PREDICT MARKER CENTRE WHILE COASTING
+        Args:
+                t         : (float, required) Time in seconds.
+
+        Returns:
+                position  : (arr of 2 float) Predicted marker centre, or None when there is no
+                            track or it is more than coast_time old.
+        '''
+
+        if self.last_time is None or t - self.last_time >= self.coast_time:
+            return None
+
+        return self.position + self.velocity*(t - self.last_time)
+
+class AudioCueTimer(object):
+    ''' CUE AND ENCOURAGEMENT DEADLINES ARMED ON ROBOT STOP/MOVE CHANGES
+            While the robot is stopped, a cue is played every cue_time seconds. When it
+            moves again less than short_stop seconds after it stopped or after the last cue,
+            encouragement is played, at most once every encouragement_time seconds, for as
+            long as it keeps moving. Deadlines fire on the scheduler thread; the frame loop
+            only reports the robot state, which costs one comparison unless it changed.
+            Timer state is shared by both threads and locked; audio requests are sent
+            outside the lock, so a slow request never stalls the frame loop.
+    Args:
+            scheduler           : (DeadlineScheduler, required) Scheduler the deadlines are armed on.
+            audio_dispatcher    : (AudioDispatcher,   required) Dispatcher audio requests are sent to.
+            cue_time            : (float,             optional) Seconds stopped before a cue. Defaults to 3.0.
+            encouragement_time  : (float,             optional) Seconds between encouragements. Defaults to 3.0.
+            short_stop          : (float,             optional) Longest stop followed by encouragement. Defaults to 1.0.
+    '''
 
-        if (encouragement_play_flag == 1):
-            encouragement_play_flag = 0
-            encouragement_start_time = time()
+    def __init__(self, scheduler, audio_dispatcher, cue_time=3.0, encouragement_time=3.0, short_stop=1.0):
+        self.scheduler = scheduler
+        self.audio_dispatcher = audio_dispatcher
+        self.cue_time = cue_time
+        self.encouragement_time = encouragement_time
+        self.short_stop = short_stop
+
+        # session starts stopped
+        self.moving = None
+        self.stop_time = perf_counter()
+        self.encouragement_time_played = -np.inf
+        self.lock = threading.Lock()
+
+    def update(self, moving):
+        ''' ARM OR CANCEL DEADLINES WHEN ROBOT STARTS OR STOPS MOVING
+        Args:
+                moving  : (bool, required) Whether the robot is moving (marker seen or coasting).
+        '''
+
+        if moving == self.moving:
+            return
+
+        with self.lock:
+            self.moving = moving
+
+            now = perf_counter()
+            if moving:
+                self.scheduler.cancel(CUE)
+                if now - self.stop_time < self.short_stop:
+                    self.scheduler.arm(ENCOURAGEMENT, max(now, self.encouragement_time_played + self.encouragement_time), \
+                                       self.playEncouragement)
+            else:
+                self.scheduler.cancel(ENCOURAGEMENT)
+                self.stop_time = now
+                self.scheduler.arm(CUE, now + self.cue_time, self.playCue)
 
-        # frame operations
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    def playCue(self):
+        ''' REQUEST CUE AND ARM NEXT ONE; RUNS ON SCHEDULER THREAD
 
-        # get aruco dict
-        aruco_dict = aruco.Dictionary_get(aruco.DICT_5X5_250)
+        '''
 
-        # detector parameters
-        parameters = aruco.DetectorParameters_create()
-        parameters.adaptiveThreshConstant = 10
+        with self.lock:
+            # robot moved while deadline was firing
+            if self.moving:
+                return
+            self.stop_time = perf_counter()
+            self.scheduler.arm(CUE, self.stop_time + self.cue_time, self.playCue)
 
-        # detect aruco markers
-        corners, ids, rejectedImgPoints = aruco.detectMarkers(gray, aruco_dict, parameters=parameters)
-
-        # check if the ids list is not empty if no check is added the code will crash
-        if np.all(ids != None): # when marker is detected
-
-            # estimate pose of each marker and return the values rvet and tvec-different from camera coefficients
-            rvec, tvec ,_ = aruco.estimatePoseSingleMarkers(corners, 0.05, mtx, dist)
-
-            # code to show ids of the marker found
-            strg = ''
-            for i in range(0, ids.size):
-                strg += str(ids[i][0])+', '
-
-            # robot
-            stop_flag = 0
-            robotStop_start_time = time() # reset robotStop_start_time to 0
-            if (ids[i][0] == 0):
-                robot.forward()
-                prev_robot_direction = 0
-            elif (ids[i][0] == 1):
-                robot.backward()
-                prev_robot_direction = 1
-
-            print(str(time())+',1,,')
-
-            spd = SENSITIVITY
-        else: # when marker is not detected
-            # robot
-            if spd != 0:
-                # move robot for every n frames after last detection of marker where n is function of sensitivity
-                stop_flag = 0
-                robotStop_start_time = time() # reset robotStop_start_time to 0
-                if (prev_robot_direction == 0):
-                    robot.forward()
-                elif (prev_robot_direction == 1):
-                    robot.backward()
+        self.audio_dispatcher.request(CUE)
 
-                print(str(time())+',1,,')
-                 
-                spd -= 1
-            else:
-                stop_flag = 1
-                robotStop_end_time = time()
-                robotStop_time_elasped = robotStop_end_time - robotStop_start_time
-
-                robot.stop()
-
-                print(str(time())+',0,,')
-                    
-
-        # audio cues
-        cue_time_thres = 3.0
-        if (robotStop_time_elasped > cue_time_thres and stop_flag == 1):
-            global_params.mixer.Sound(cue[randint(0, len(global_params.cue)-1)]).play()
-            cue_play_flag = 1
-
-        encouragement_time_thres = 1.0
-        if (robotStop_time_elasped < encouragement_time_thres and stop_flag == 0):
-            try:
-                if (abs(encouragement_start_time - time()) > 3.0):
-                    global_params.mixer.Sound(encouragement[randint(0, len(global_params.encouragement)-1)]).play()
-                    encouragement_play_flag = 1
-            except:
-                global_params.mixer.Sound(encouragement[randint(0, len(global_params.encouragement)-1)]).play()
-                encouragement_play_flag = 1
-
-        # openCV truncate to prevent resolution buffer length error
-        rawCapture.truncate(0)
-        
-
-def trackerFollower_webcam(camera, camera_resolution, robot, cue, encouragement, stop_trackerFollower, sensitivity):
+    def playEncouragement(self):
+        ''' REQUEST ENCOURAGEMENT AND ARM NEXT ONE; RUNS ON SCHEDULER THREAD
+
+        '''
+
+        with self.lock:
+            # robot stopped while deadline was firing
+            if not self.moving:
+                return
+            self.encouragement_time_played = perf_counter()
+            self.scheduler.arm(ENCOURAGEMENT, self.encouragement_time_played + self.encouragement_time, \
+                               self.playEncouragement)
+
+        self.audio_dispatcher.request(ENCOURAGEMENT)
+
+def trackerFollower(frame_source, camera_resolution, robot, cue, encouragement, stop_trackerFollower, sensitivity):
     ''' FUNCTION TO TRACK ARUCO MARKERS AND ACTIVATE GPIO ROBOT MOVEMENT 
     Args:
-            camera                : (camera obj,   required) Either Pi camera or webcam object based on setting in main.py
+            frame_source          : (FrameSource,  required) Pi camera or webcam frame source based on setting in main.py
             camera_resolution     : (arr of 2 int, required) Camera resolution in pixels
             robot                 : (robot obj,    required) GPIO robot created in main.py
             cue                   : (arr,          required) List of audio cue files available.
@@ -170,107 +622,111 @@ def trackerFollower_webcam(camera, camera_resolution, robot, cue, encouragement,
             sensitivity           : (int,          required) Sensitivity setting of robot
     '''
     
-    camera_resolution = camera_resolution
-
-    # audio flags
-    cue_play_flag = 0
-    encouragement_play_flag = 0
-
-    # timing
     stop_flag = 1
-    robotStop_start_time = time() # start counting time when robot is stopped
 
-    SENSITIVITY = sensitivity * 10
-    spd = 0 
+    # coast for a fixed time after marker is lost, independent of frame rate
+    coast_time = sensitivity * 10 / COAST_REFERENCE_FPS
+    predictor = MarkerPredictor(coast_time)
     prev_robot_direction = None
+    command = STOP
+    frame_count = 0
 
-    while(True):
-        # read each frame from camera
-        ret, frame = camera.read()
+    # marker detector built once per session
+    detector = MarkerDetector(mtx, dist, tracking=True, scale=0.5, change_threshold=12.0)
+    global_params.marker_detector = detector
 
-        if global_params.stop_trackerFollower:
-            break
+    # frame rate paced by robot state
+    governor = FrameRateGovernor(frame_source)
 
-        if (cue_play_flag == 1):
-            cue_play_flag = 0
-            robotStop_start_time = time() # reset robotStop_start_time to 0
+    # audio cues timed on their own thread
+    scheduler = DeadlineScheduler()
+    cue_timer = AudioCueTimer(scheduler, global_params.audio_dispatcher)
 
-        if (encouragement_play_flag == 1):
-            encouragement_play_flag = 0
-            encouragement_start_time = time()
+    # main
+    try:
+        frame_source.start()
+        while(True):
+            # read newest frame from camera; paced by frame source
+            frame = frame_source.read()
 
-        # frame operations
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            if global_params.stop_trackerFollower:
+                break
 
-        # get aruco dict
-        aruco_dict = aruco.Dictionary_get(aruco.DICT_5X5_250)
+            if frame is None:
+                continue
 
-        # detector parameters
-        parameters = aruco.DetectorParameters_create()
-        parameters.adaptiveThreshConstant = 10
+            # frame operations
+            if frame.ndim == 2:
+                gray = frame
+            else:
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 
-        # detect aruco markers
-        corners, ids, rejectedImgPoints = aruco.detectMarkers(gray, aruco_dict, parameters=parameters)
-
-        # check if the ids list is not empty if no check is added the code will crash
-        if np.all(ids != None):
-
-            # estimate pose of each marker and return the values rvet and tvec-different from camera coefficients
-            rvec, tvec ,_ = aruco.estimatePoseSingleMarkers(corners, 0.05, mtx, dist)
-
-            # code to show ids of the marker found
-            strg = ''
-            for i in range(0, ids.size):
-                strg += str(ids[i][0])+', '
-
-            # robot
-            stop_flag = 0
-            robotStop_start_time = time() # reset robotStop_start_time to 0
-            if (ids[i][0] == 0):
-                robot.forward()
-                prev_robot_direction = 0
-            elif (ids[i][0] == 1):
-                robot.backward()
-                prev_robot_direction = 1
-
-            print(str(time())+',1,,')
-
-            spd = SENSITIVITY
-        else: # when marker is not detected
-            # robot
-            if spd != 0:
-                # move robot for every n frames after last detection of marker where n is function of sensitivity
+            # detect aruco markers
+            corners, ids = detector.detect(gray)
+
+            # check if the ids list is not empty if no check is added the code will crash
+            if np.all(ids != None): # when marker is detected
+
+                # code to show ids of the marker found
+                strg = ''
+                for i in range(0, ids.size):
+                    strg += str(ids[i][0])+', '
+
+                # track marker centre
+                [marker_x, marker_y] = corners[i][0].mean(axis=0)
+                predictor.update([marker_x, marker_y], perf_counter())
+
+                # robot
                 stop_flag = 0
-                robotStop_start_time = time() # reset robotStop_start_time to 0
-                if (prev_robot_direction == 0):
+                if (ids[i][0] == 0):
                     robot.forward()
-                elif (prev_robot_direction == 1):
+                    prev_robot_direction = 0
+                    command = FORWARD
+                elif (ids[i][0] == 1):
                     robot.backward()
-
-                print(str(time())+',1,,')
-                 
-                spd -= 1
-            else:
-                stop_flag = 1
-                robotStop_end_time = time()
-                robotStop_time_elasped = robotStop_end_time - robotStop_start_time
-
-                robot.stop()
-
-                print(str(time())+',0,,')
-
-        # audio cues
-        cue_time_thres = 3.0
-        if (robotStop_time_elasped > cue_time_thres and stop_flag == 1):
-            global_params.mixer.Sound(cue[randint(0, len(global_params.cue)-1)]).play()
-            cue_play_flag = 1
-
-        encouragement_time_thres = 1.0
-        if (robotStop_time_elasped < encouragement_time_thres and stop_flag == 0):
-            try:
-                if (abs(encouragement_start_time - time()) > 3.0):
-                    global_params.mixer.Sound(encouragement[randint(0, len(global_params.encouragement)-1)]).play()
-                    encouragement_play_flag = 1
-            except:
-                global_params.mixer.Sound(encouragement[randint(0, len(global_params.encouragement)-1)]).play()
-                encouragement_play_flag = 1
+                    prev_robot_direction = 1
+                    command = BACKWARD
+
+                global_params.recorder.logCamera(1)
+            else: # when marker is not detected
+                # robot
+                predicted = predictor.predict(perf_counter())
+                if predicted is not None:
+                    # move robot for coast_time after last detection of marker where coast_time is function of sensitivity
+                    detector.centerROI(predicted[0], predicted[1])
+                    stop_flag = 0
+                    if (prev_robot_direction == 0):
+                        robot.forward()
+                        command = FORWARD
+                    elif (prev_robot_direction == 1):
+                        robot.backward()
+                        command = BACKWARD
+
+                    global_params.recorder.logCamera(1)
+                else:
+                    stop_flag = 1
+
+                    robot.stop()
+                    command = STOP
+
+                    global_params.recorder.logCamera(0)
+
+            governor.update(stop_flag == 0)
+            cue_timer.update(stop_flag == 0)
+
+            # publish latest marker state and motor command
+            frame_count += 1
+            if global_params.tracker_state is not None:
+                if np.all(ids != None):
+                    global_params.tracker_state.publish(frame_count=frame_count, marker_id=ids[i][0], \
+                                                        marker_x=marker_x, marker_y=marker_y, command=command, \
+                                                        rate_state=governor.state)
+                else:
+                    global_params.tracker_state.publish(frame_count=frame_count, marker_id=-1, command=command, \
+                                                        rate_state=governor.state)
+
+    finally:
+        # stop cues, robot and camera however the loop ends
+        scheduler.close()
+        robot.stop()
+        frame_source.stop()
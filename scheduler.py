@@ -0,0 +1,112 @@
+'''
+__author       = "Chen Si-En, Sarah"
+__copyright    = "Copyright 2021, Chen Si-En, Sarah"
+
+__description  = "Deadline scheduler firing timed callbacks on its own thread"
+__version      = "1.2.0"
+__status       = "Production"
+__dependencies = "threading"
+'''
+
+import heapq
+import threading
+from time import perf_counter
+
+class DeadlineScheduler(object):
+    ''' ONE-SHOT DEADLINES FIRED ON A BACKGROUND THREAD
+            Deadlines are perf_counter times kept in a heap; the thread sleeps until the
+            earliest one is due, so waiting deadlines cost no CPU. Each deadline has a key;
+            arming a key replaces its previous deadline and cancelling it is one dict
+            update, as replaced entries are skipped when they come off the heap. Callbacks
+            run on the scheduler thread with the scheduler unlocked, so a slow callback
+            never stalls arm or cancel, and callbacks may arm or cancel deadlines
+            themselves. A deadline cancelled while its callback is starting may still fire
+            once; callbacks that must not should check their own state.
+
+    '''
+
+    def __init__(self):
+        # heap of (deadline, sequence, key, callback); armed sequence of each key
+        self.heap = []
+        self.armed = {}
+        self.seq = 0
+
+        self.running = True
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def arm(self, key, deadline, callback):
+        ''' ARM DEADLINE OF KEY, REPLACING ANY EARLIER ONE
+        Args:
+                key       : (obj,      required) Name of deadline.
+                deadline  : (float,    required) perf_counter time to fire at.
+                callback  : (function, required) Called without arguments when due.
+        '''
+
+        with self.cond:
+            self.armed[key] = self.seq
+            heapq.heappush(self.heap, (deadline, self.seq, key, callback))
+            self.seq += 1
+            self.cond.notify()
+
+    def cancel(self, key):
+        ''' CANCEL DEADLINE OF KEY, IF ARMED
+        Args:
+                key  : (obj, required) Name of deadline.
+        '''
+
+        with self.cond:
+            self.armed.pop(key, None)
+
+    def isArmed(self, key):
+        ''' WHETHER DEADLINE OF KEY IS WAITING TO FIRE
+        Args:
+                key    : (obj, required) Name of deadline.
+
+        Returns:
+                armed  : (bool)
+        '''
+
+        with self.cond:
+            return key in self.armed
+
+    def run(self):
+        ''' SCHEDULER LOOP; RUNS ON BACKGROUND THREAD
+
+        '''
+
+        while True:
+            with self.cond:
+                while self.running:
+                    # drop replaced and cancelled entries
+                    while len(self.heap) > 0 and self.armed.get(self.heap[0][2]) != self.heap[0][1]:
+                        heapq.heappop(self.heap)
+
+                    if len(self.heap) == 0:
+                        self.cond.wait()
+                        continue
+
+                    delay = self.heap[0][0] - perf_counter()
+                    if delay <= 0:
+                        break
+                    self.cond.wait(delay)
+
+                if not self.running:
+                    return
+
+                [deadline, seq, key, callback] = heapq.heappop(self.heap)
+                del self.armed[key]
+
+            callback()
+
+    def close(self):
+        ''' STOP BACKGROUND THREAD; WAITING DEADLINES NEVER FIRE
+
+        '''
+
+        with self.cond:
+            self.running = False
+            self.armed.clear()
+            self.cond.notify()
+        self.thread.join()
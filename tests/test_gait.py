@@ -0,0 +1,163 @@
+'''
+__author       = "Chen Si-En, Sarah"
+__copyright    = "Copyright 2021, Chen Si-En, Sarah"
+
+__description  = "Streaming gait analyzer against batch gait kernel on synthetic sessions"
+__version      = "1.2.0"
+__status       = "Production"
+__dependencies = "numpy, pytest, gait.py, eventlog.py"
+'''
+
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from gait import gaitKernel, segmentCameraRuns, readSessionFrames, GaitAnalyzer
+from eventlog import EVENT_DTYPE, SESSION_COLUMNS, SOURCE_LEFT_IMU, SOURCE_RIGHT_IMU, SOURCE_CAMERA
+
+def synthBurstySession(minutes=2, fs=20.0, stride=1.1, burst=0.2, jitter=0.0, swing=0.0, seed=0):
+    ''' SYNTHETIC IMU RECORDS OF BOTH LEGS DELIVERED IN BLUETOOTH BURSTS
+            Samples are taken every 1/fs s but stamped with the host time of the burst
+            they arrive in, a few lines at almost the same time every burst seconds.
+    Args:
+            minutes  : (float, optional) Session length. Defaults to 2.
+            fs       : (float, optional) Sample rate of IMU. Defaults to 20.
+            stride   : (float, optional) Stride time in seconds. Defaults to 1.1.
+            burst    : (float, optional) Mean seconds between bursts. Defaults to 0.2.
+            jitter   : (float, optional) Largest deviation of burst spacing in seconds. Defaults to 0.
+            swing    : (float, optional) Relative change of gx amplitude, over about 44 s. Defaults to 0.
+            seed     : (int,   optional) Random seed. Defaults to 0.
+
+    Returns:
+            records  : (arr) Time-ordered EVENT_DTYPE records.
+    '''
+
+    rng = np.random.default_rng(seed)
+    t = np.arange(0, minutes*60, 1/fs)
+    bursts = np.cumsum(burst + rng.uniform(-jitter, jitter, int(minutes*60/(burst-jitter)) + 2))
+
+    records = []
+    for leg in (SOURCE_LEFT_IMU, SOURCE_RIGHT_IMU):
+        phase = 2*np.pi*t/stride + leg*np.pi
+        gyro = np.stack([80*np.sin(phase) + rng.normal(0, 3, len(t)), 40*np.cos(phase), 10*np.sin(2*phase)], 1)
+        gyro[:,0] *= 1 + swing*np.sin(t/7)
+
+        # lines of a burst 0.1 ms apart
+        host = bursts[np.searchsorted(bursts, t)]
+        host = host + (np.arange(len(t)) - np.searchsorted(host, host)) * 1e-4
+        records.extend([(1.7e9 + h, leg, -1, g[0], g[1], g[2]) for h, g in zip(host, gyro)])
+
+    records = np.array(records, dtype=EVENT_DTYPE)
+    return records[np.argsort(records['timestamp'], kind='stable')]
+
+def runBoth(records, batch_time=0.5):
+    ''' RESULTS OF BATCH KERNEL AND OF STREAMING ANALYZER FED IN RECORDER BATCHES
+    Args:
+            records     : (arr,   required) Time-ordered EVENT_DTYPE records.
+            batch_time  : (float, optional) Seconds of records per batch. Defaults to 0.5.
+
+    Returns:
+            batch, stream  : Cadence and stride time of each.
+            imu, analyzer  : Kernel result and analyzer fed all batches.
+    '''
+
+    legs = (SOURCE_LEFT_IMU, SOURCE_RIGHT_IMU)
+    gyro = np.stack([records['gx'], records['gy'], records['gz']], 1).astype(np.float64)
+    imu = gaitKernel([records['timestamp'][records['source'] == leg] for leg in legs], \
+                     [gyro[records['source'] == leg] for leg in legs])
+    batch = (int(imu["cadence"]), round(imu["stride_time"], 2))
+
+    analyzer = GaitAnalyzer()
+    timestamp = records['timestamp']
+    for start in np.arange(timestamp[0], timestamp[-1] + batch_time, batch_time):
+        analyzer.update(records[(timestamp >= start) & (timestamp < start + batch_time)])
+
+    return batch, analyzer.getCadenceStrideTime(), imu, analyzer
+
+@pytest.mark.parametrize("burst, jitter, seed", [(0.2, 0.0, 0), (0.15, 0.05, 1), (0.2, 0.04, 2)])
+def test_bursty_streaming_matches_batch(burst, jitter, seed):
+    batch, stream, imu, analyzer = runBoth(synthBurstySession(burst=burst, jitter=jitter, seed=seed))
+
+    assert stream != ('NA', 'NA')
+    assert stream == batch
+
+def test_regular_streaming_matches_batch():
+    batch, stream, imu, analyzer = runBoth(synthBurstySession(burst=0.05, seed=3))
+
+    assert stream == batch
+
+@pytest.mark.parametrize("seed", [5, 6])
+def test_varying_amplitude_streaming_matches_batch(seed):
+    # prominence of a valley depends on samples long after it
+    batch, stream, imu, analyzer = runBoth(synthBurstySession(minutes=10, burst=0.05, swing=0.5, seed=seed))
+
+    assert stream == batch
+
+def test_streaming_leg_strides_match_kernel():
+    batch, stream, imu, analyzer = runBoth(synthBurstySession(burst=0.05, seed=4))
+    res = analyzer.getIMUResult()
+
+    for leg in (SOURCE_LEFT_IMU, SOURCE_RIGHT_IMU):
+        assert res["legs"][leg]["cadence"] == imu["legs"][leg]["cadence"]
+        assert res["legs"][leg]["stride_time"] == pytest.approx(imu["legs"][leg]["stride_time"])
+        assert np.allclose(res["legs"][leg]["strides"], imu["legs"][leg]["strides"])
+    assert res["stride_time"] == pytest.approx(imu["stride_time"])
+
+def test_gaitKernel_combines_any_number_of_legs():
+    records = synthBurstySession(burst=0.05, seed=7)
+    rows = records['source'] == SOURCE_LEFT_IMU
+    gyro = np.stack([records['gx'], records['gy'], records['gz']], 1).astype(np.float64)
+
+    imu = gaitKernel([records['timestamp'][rows]], [gyro[rows]])
+    assert imu["cadence"] == imu["legs"][0]["cadence"]
+    assert imu["stride_time"] == imu["legs"][0]["stride_time"]
+
+    imu = gaitKernel([records['timestamp'][rows]] * 3, [gyro[rows]] * 3)
+    assert imu["cadence"] == imu["legs"][0]["cadence"]
+
+@pytest.mark.parametrize("seed, first_state", [(0, 0), (1, 0), (2, 1)])
+def test_streaming_camera_matches_segmentCameraRuns(seed, first_state):
+    rng = np.random.default_rng(seed)
+    timestamp = 1.7e9 + np.cumsum(rng.uniform(0.03, 0.1, 3000))
+    state = (rng.random(3000) < 0.5).astype(int)
+    state = np.repeat(state[::10], 10)[:3000] ^ (rng.random(3000) < 0.05)
+    state[:5] = first_state
+
+    cadence, stride_time, stop_time = segmentCameraRuns(state, timestamp)
+
+    # batches of random size, some of a single row
+    analyzer = GaitAnalyzer()
+    ends = np.sort(rng.choice(np.arange(1, 3000), 300, replace=False))
+    for start, end in zip(np.concatenate([[0], ends]), np.concatenate([ends, [3000]])):
+        analyzer.updateCamera(state[start:end], timestamp[start:end])
+
+    assert analyzer.num_runs == cadence
+    if cadence > 1:
+        assert analyzer.getCadenceStrideTime() == (int(cadence), round(stride_time, 2))
+        assert [analyzer.first_run_time, analyzer.last_run_time] == [stop_time[0], stop_time[-1]]
+
+def test_readSessionFrames_slice_matches_full_session(tmp_path):
+    records = synthBurstySession(minutes=1, burst=0.1)
+    cam_time = records['timestamp'][0] + np.arange(0, 60, 0.1)
+    cam = np.array([(t, SOURCE_CAMERA, i//7 % 2, np.nan, np.nan, np.nan) for i, t in enumerate(cam_time)], dtype=EVENT_DTYPE)
+    records = np.concatenate([records, cam])
+
+    # flushes of 0.5 s, rows of a flush shifted up to 0.2 s back in time
+    timestamp = records['timestamp']
+    flush = np.floor((timestamp - timestamp[0]) / 0.5)
+    records['timestamp'] -= np.random.default_rng(0).uniform(0, 0.2, len(records)) * (flush % 2)
+    records = records[np.lexsort([records['timestamp'], flush])]
+    for name, dtype in SESSION_COLUMNS:
+        records[name].tofile(str(tmp_path / (name + '.col')))
+
+    start = timestamp[0] + 20.37
+    end = timestamp[0] + 35.37
+    full = readSessionFrames(str(tmp_path))
+    part = readSessionFrames(str(tmp_path), start, end)
+
+    for f, p in zip(full, part):
+        f = f[(f[0] >= start) & (f[0] < end)]
+        assert len(p) > 0
+        assert np.array_equal(f.to_numpy(), p.to_numpy())
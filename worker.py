@@ -0,0 +1,285 @@
+'''
+__author       = "Chen Si-En, Sarah"
+__copyright    = "Copyright 2021, Chen Si-En, Sarah"
+
+__description  = "Tracker worker process with shared-memory marker state for Rehabot 2.0"
+__version      = "1.2.0"
+__status       = "Production"
+__dependencies = "multiprocessing, global_params.py, robot.py"
+'''
+
+import sys
+import threading
+import traceback
+import multiprocessing
+from time import time, perf_counter, sleep
+import global_params
+
+# shared marker state layout
+STATE_FIELDS = ['seq', 'timestamp', 'camera_status', 'running', 'frame_count', \
+                'marker_id', 'marker_x', 'marker_y', 'command', 'rate_state']
+STATE_INDEX = {name: i for i, name in enumerate(STATE_FIELDS)}
+
+class TrackerState(object):
+    ''' LATEST MARKER STATE AND MOTOR COMMAND IN SHARED MEMORY
+            Single writer (tracker), any number of readers. A sequence counter that is
+            odd while a write is in progress lets readers retry instead of locking.
+    Args:
+            ctx  : (multiprocessing context, optional) Context to allocate shared memory from.
+    '''
+
+    def __init__(self, ctx=multiprocessing):
+        self.block = ctx.RawArray('d', len(STATE_FIELDS))
+        self.block[STATE_INDEX['marker_id']] = -1
+
+    def publish(self, **fields):
+        ''' WRITE FIELDS TO SHARED BLOCK
+        Args:
+                fields  : (float, required) Values keyed by names in STATE_FIELDS.
+        '''
+
+        block = self.block
+        block[0] += 1
+        block[STATE_INDEX['timestamp']] = time()
+        for name, val in fields.items():
+            block[STATE_INDEX[name]] = val
+        block[0] += 1
+
+    def read(self):
+        ''' READ CONSISTENT SNAPSHOT OF SHARED BLOCK
+
+        Returns:
+                state  : (dict) Values keyed by names in STATE_FIELDS.
+        '''
+
+        while True:
+            seq = self.block[0]
+            if seq % 2 == 0:
+                vals = self.block[:]
+                if self.block[0] == seq:
+                    return dict(zip(STATE_FIELDS, vals))
+            sleep(0)
+
+class RemoteStdout(object):
+    ''' STDOUT OF WORKER PROCESS; FORWARDS PRINTED LINES TO MAIN PROCESS
+
+    '''
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.pending = ''
+
+    def write(self, text):
+        # send whole lines only; print() writes text and line ending separately
+        self.pending += text
+        if self.pending.endswith('\n'):
+            self.conn.send(('print', self.pending))
+            self.pending = ''
+        return len(text)
+
+    def flush(self):
+        pass
+
+class RemoteRecorder(object):
+    ''' SESSION RECORDER OF WORKER PROCESS; SENDS CAMERA EVENTS TO MAIN PROCESS
+
+    '''
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def logCamera(self, state, timestamp=None):
+        self.conn.send(('camera', time() if timestamp is None else timestamp, state))
+
+class RemoteAudioDispatcher(object):
+    ''' AUDIO DISPATCHER OF WORKER PROCESS; SENDS REQUESTS TO DISPATCHER OF MAIN PROCESS
+
+    '''
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def request(self, category, timestamp=None):
+        # perf_counter is system-wide, so latency is measured from the worker's request
+        self.conn.send(('audio', category, perf_counter() if timestamp is None else timestamp))
+
+def waitForStop(control, received):
+    ''' SET STOP FLAG WHEN STOP COMMAND ARRIVES FROM MAIN PROCESS
+    Args:
+            control   : (Connection, required) Control channel to main process.
+            received  : (arr,        required) List the stop/quit command is appended to.
+    '''
+
+    while True:
+        try:
+            msg = control.recv()
+        except EOFError:
+            # main process has gone; stop and quit
+            msg = ('quit',)
+        if msg[0] in ('stop', 'quit'):
+            received.append(msg)
+            global_params.stop_trackerFollower = True
+            return
+
+def serve(control, events, state, createFrameSource, createRobot, camera_resolution):
+    ''' WORKER PROCESS MAIN LOOP
+    Args:
+            control            : (Connection,   required) Control channel to main process.
+            events             : (Connection,   required) Channel for printed lines, camera events and audio requests to main process.
+            state              : (TrackerState, required) Shared marker state.
+            createFrameSource  : (function,     required) Returns [frame_source, camera_status].
+            createRobot        : (function,     required) Returns GPIO robot.
+            camera_resolution  : (arr of 2 int, required) Camera resolution in pixels
+    '''
+
+    from robot import trackerFollower
+
+    # camera, GPIO and audio are opened by this process only
+    sys.stdout = RemoteStdout(events)
+    global_params.audio_dispatcher = RemoteAudioDispatcher(events)
+    global_params.recorder = RemoteRecorder(events)
+    global_params.tracker_state = state
+
+    [frame_source, camera_status] = createFrameSource()
+    robot = createRobot()
+    state.publish(camera_status=camera_status)
+    control.send(('ready', camera_status))
+
+    while True:
+        msg = control.recv()
+
+        if msg[0] == 'start':
+            [cue, encouragement, sensitivity] = msg[1:]
+            global_params.cue = cue
+            global_params.encouragement = encouragement
+            global_params.stop_trackerFollower = False
+
+            received = []
+            listener = threading.Thread(target=waitForStop, args=(control, received), daemon=True)
+            listener.start()
+
+            state.publish(running=1)
+            try:
+                trackerFollower(frame_source, camera_resolution, robot, cue, encouragement, False, sensitivity)
+            except Exception:
+                # main process treats the tracker as stopped; worker exits without
+                # waiting for a stop command
+                events.send(('error', traceback.format_exc()))
+                break
+            finally:
+                robot.stop()
+                state.publish(running=0, command=0)
+
+            listener.join()
+            control.send(('stopped',))
+
+            if received[0][0] == 'quit':
+                break
+
+        elif msg[0] == 'quit':
+            break
+
+    robot.stop()
+
+class TrackerProcess(object):
+    ''' RUNS TRACKER LOOP IN A SEPARATE PROCESS
+            Keeps detection off the GIL shared with the GUI, IMU readers and metronome.
+            The worker publishes the latest marker state and motor command to a
+            TrackerState block, and takes start/stop commands over a pipe. Printed log
+            lines, camera events and audio are sent back to be written, logged and played
+            by this process. If the tracker fails, the worker sends its traceback and
+            exits, and the tracker counts as stopped from then on.
+    Args:
+            createFrameSource  : (function,     required) Returns [frame_source, camera_status]; called in worker.
+            createRobot        : (function,     required) Returns GPIO robot; called in worker.
+            camera_resolution  : (arr of 2 int, required) Camera resolution in pixels
+    '''
+
+    def __init__(self, createFrameSource, createRobot, camera_resolution):
+        ctx = multiprocessing.get_context('fork')
+        self.state = TrackerState(ctx)
+        self.control, self.child_control = ctx.Pipe()
+        self.events, self.child_events = ctx.Pipe(duplex=False)
+        self.process = ctx.Process(target=serve, \
+                                   args=(self.child_control, self.child_events, self.state, \
+                                         createFrameSource, createRobot, camera_resolution), \
+                                   daemon=True)
+        self.relay = threading.Thread(target=self.relayEvents, daemon=True)
+
+        # set once worker has failed or exited
+        self.stopped = threading.Event()
+
+    def start(self):
+        ''' START WORKER PROCESS
+
+        Returns:
+                camera_status  : (bool) Whether worker opened the camera.
+        '''
+
+        self.process.start()
+
+        # worker ends only; closed here so a worker exit is seen as EOF or a broken pipe
+        self.child_control.close()
+        self.child_events.close()
+
+        self.relay.start()
+        msg = self.control.recv()
+
+        return bool(msg[1])
+
+    def relayEvents(self):
+        ''' WRITE PRINTED LINES, LOG CAMERA EVENTS AND PLAY AUDIO SENT BY WORKER
+
+        '''
+
+        while True:
+            try:
+                msg = self.events.recv()
+            except EOFError:
+                self.stopped.set()
+                return
+
+            if msg[0] == 'error':
+                sys.stdout.write('Tracker process failed:\n' + msg[1])
+                self.stopped.set()
+            elif msg[0] == 'print':
+                sys.stdout.write(msg[1])
+            elif msg[0] == 'camera':
+                global_params.recorder.logCamera(msg[2], msg[1])
+            elif msg[0] == 'audio':
+                global_params.audio_dispatcher.request(msg[1], msg[2])
+
+    def trackerFollower(self, frame_source, camera_resolution, robot, cue, encouragement, stop_trackerFollower, sensitivity):
+        ''' DROP-IN REPLACEMENT FOR robot.trackerFollower
+                Starts a session in the worker and returns once global_params.stop_trackerFollower
+                is set and the worker has stopped the robot, or once the worker has failed.
+        '''
+
+        if self.stopped.is_set():
+            return
+
+        try:
+            self.control.send(('start', cue, encouragement, sensitivity))
+
+            while not global_params.stop_trackerFollower and not self.stopped.is_set():
+                sleep(0.05)
+            if self.stopped.is_set():
+                return
+
+            self.control.send(('stop',))
+            self.control.recv()
+        except (BrokenPipeError, EOFError):
+            # worker has exited; tracker stopped
+            self.stopped.set()
+
+    def close(self):
+        ''' STOP WORKER PROCESS
+
+        '''
+
+        if self.process.is_alive():
+            try:
+                self.control.send(('quit',))
+            except (BrokenPipeError, EOFError):
+                pass
+            self.process.join(timeout=2.0)